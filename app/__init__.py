@@ -1,13 +1,18 @@
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
 from datetime import datetime
 from typing import Literal
 from zoneinfo import ZoneInfo
-from flask import Flask, send_from_directory
+from flask import Flask, abort, make_response, send_from_directory
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from .config import apply_runtime_google_credentials
+from .fast_json import ORJSONProvider, SocketIOJSON
 
 # Load environment variables from .env file
 load_dotenv()
@@ -35,8 +40,13 @@ def _get_socketio_async_mode() -> Literal['threading', 'eventlet', 'gevent', 'ge
 socketio = SocketIO(
     cors_allowed_origins='*',
     async_mode=_get_socketio_async_mode(),
+    json=SocketIOJSON,
 )
 
+# Background thread that writes log records handed over by request threads
+_log_listener = None
+
+
 # Module-level holder for the created app; set by create_app() so that
 # background threads (e.g. ADK agent tools) can push an app context even
 # when no Flask request context is active.
@@ -70,6 +80,33 @@ def _build_timezone_converter(timezone_name: str):
     return _converter
 
 
+def _route_logging_through_queue() -> None:
+    """Move root handlers behind a queue so request threads never block on stderr."""
+    global _log_listener
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, *root.handlers, respect_handler_level=True
+    )
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _log_listener.start()
+
+
+@atexit.register
+def _stop_log_listener() -> None:
+    """Flush queued log records on shutdown."""
+    global _log_listener
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
 def _configure_logging() -> None:
     """Configure consistent logging across all startup modes."""
     app_log_level = os.environ.get('APP_LOG_LEVEL', 'INFO').upper()
@@ -84,6 +121,8 @@ def _configure_logging() -> None:
         format='[%(asctime)s] %(levelname)s in %(name)s: %(message)s',
         force=True,
     )
+    if os.environ.get('APP_LOG_ASYNC', 'true').lower() == 'true':
+        _route_logging_through_queue()
 
     # Ensure RAG pipeline logs are always visible regardless of runner.
     logging.getLogger('app.rag').setLevel(getattr(logging, rag_log_level, logging.DEBUG))
@@ -108,6 +147,7 @@ def create_app():
     """Create and configure an instance of the Flask application."""
     _configure_logging()
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
 
     # Load configuration from app/config.py
     app.config.from_object('app.config.Config')
@@ -137,6 +177,8 @@ def create_app():
         cors_allowed_origins=app.config.get('CORS_ALLOWED_ORIGINS', '*'),
         ping_timeout=app.config.get('SOCKETIO_PING_TIMEOUT', 60),
         ping_interval=app.config.get('SOCKETIO_PING_INTERVAL', 25),
+        http_compression=app.config.get('SOCKETIO_HTTP_COMPRESSION', True),
+        compression_threshold=app.config.get('SOCKETIO_COMPRESSION_THRESHOLD', 256),
     )
 
     # Initialize Firebase Admin SDK (optional — gracefully disabled if not configured)
@@ -144,8 +186,7 @@ def create_app():
     init_firebase(app)
 
     # Create an uploads folder if it doesn't exist
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
     # Register blueprints
     from . import routes
@@ -167,23 +208,31 @@ def create_app():
     if os.path.exists(videos_quesyions_path):
         @app.route('/static/videos_quesyions/<path:filename>')
         def serve_videos_quesyions(filename):
+            accel_prefix = app.config.get('VIDEOS_X_ACCEL_PREFIX')
+            if accel_prefix:
+                # Let nginx stream the file with sendfile instead of Python
+                if safe_join(videos_quesyions_path, filename) is None:
+                    abort(404)
+                response = make_response('')
+                response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+                # nginx picks the type from the file extension
+                del response.headers['Content-Type']
+                return response
             return send_from_directory(videos_quesyions_path, filename)
 
     # Optionally create tables on startup (development convenience)
     if app.config.get('CREATE_DB_ON_STARTUP'):
         try:
             with app.app_context():
-                # Ensure pgvector extension exists (required for RAG vector columns)
+                # create_all() bypasses migrations, so the Vector columns and
+                # HNSW index need the pgvector extension created here
                 if 'postgresql' in app.config.get('SQLALCHEMY_DATABASE_URI', ''):
-                    try:
-                        db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS vector'))
-                        db.session.commit()
-                    except Exception:
-                        db.session.rollback()
+                    db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS vector'))
+                    db.session.commit()
                 db.create_all()
         except Exception:
-            # If create_all fails, don't crash the app startup; log is available when running
-            pass
+            # If create_all fails, don't crash the app startup, but say why
+            app.logger.exception("CREATE_DB_ON_STARTUP: could not create tables")
 
     # Store reference so background threads can push an app context
     global _app_instance
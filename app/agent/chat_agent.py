@@ -9,10 +9,10 @@ Multi-Agent Architecture (AI Studio):
 - Media Agent: Analyzes images and videos and returns structured results to coordinator (does not interact with users)
 
 Vertex AI Support:
-- Uses same ADK multi-agent system via GOOGLE_GENAI_USE_VERTEXAI env var
-- Service account credentials written to temp file for GOOGLE_APPLICATION_CREDENTIALS
+- Uses same ADK multi-agent system with a Vertex-bound Gemini model per user
+- Project, location and credentials are passed to the genai Client explicitly;
+  process environment variables are never modified per request
 - Separate agent cache namespace (vertex_user_id) prevents mixing with AI Studio agents
-- Environment variables cleaned up after each streaming response
 
 Key Features:
 - Dual provider support: AI Studio (ADK) and Vertex AI
@@ -24,14 +24,23 @@ Key Features:
 - Per-user agent/runner isolation with API key and model preferences
 """
 import os
-import traceback
 import asyncio
+import atexit
+import hashlib
 import logging
 import json
-import tempfile
+import operator
+import queue
+import re
+import threading
 import time
 import warnings
-from typing import AsyncIterator, Optional, List, Dict, Any, Generator
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from importlib.util import find_spec
+from typing import AsyncIterator, Callable, Iterable, Optional, List, Dict, Any, Generator, Tuple
 
 # Suppress the harmless Google GenAI warning that fires when a streaming response
 # contains function_call parts alongside text (e.g. model thinking tokens).
@@ -43,14 +52,24 @@ warnings.filterwarnings(
 # Also silence it at the logging level (google.genai emits via logger, not warnings.warn)
 logging.getLogger('google_genai.types').setLevel(logging.ERROR)
 
+from functools import cached_property, lru_cache
+
+import httpx
+
 from google.adk.agents import Agent
+from google.adk.agents.context_cache_config import ContextCacheConfig
+from google.adk.apps import App
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.models import Gemini
+from google.adk.models.registry import LLMRegistry
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
+from google.adk.sessions import BaseSessionService, InMemorySessionService
 from google.adk.tools import google_search
-from google.genai import types
+from google.genai import Client, types
+from pydantic import Field
 
 from app import gcp_bucket
-from app.config import is_cloud_run_environment
+from app.config import is_cloud_run_environment, normalize_database_uri
 from app.agent.prompts import (
     COORDINATOR_AGENT_INSTRUCTION,
     PDF_AGENT_INSTRUCTION,
@@ -66,6 +85,46 @@ logger = logging.getLogger(__name__)
 # RAG Retrieval Tool (FunctionTool for ADK coordinator)
 # ---------------------------------------------------------------------------
 
+# Fixed-size pool for RAG searches so embedding + pgvector I/O has a known
+# concurrency footprint instead of growing the loop's default executor
+RAG_WORKERS = int(os.environ.get('RAG_WORKERS', '4'))
+_rag_executor = ThreadPoolExecutor(max_workers=max(1, RAG_WORKERS), thread_name_prefix="rag")
+atexit.register(lambda: _rag_executor.shutdown(wait=False))
+
+
+# Searches admitted at once per event loop; waiting happens on the loop, so a
+# cancelled tool call never leaves queued work behind in the executor
+RAG_CONCURRENCY = int(os.environ.get('RAG_CONCURRENCY', '4'))
+_rag_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_rag_semaphore() -> asyncio.Semaphore:
+    """Return the RAG semaphore for the running loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    semaphore = _rag_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _rag_semaphores.setdefault(loop, asyncio.Semaphore(max(1, RAG_CONCURRENCY)))
+    return semaphore
+
+
+_cached_flask_app = None
+
+
+def _resolve_flask_app():
+    """Return the Flask app for RAG app contexts, memoized once it exists.
+
+    Executor workers never carry an app context, so ``current_app`` cannot
+    help there; the app registered by create_app() is used instead.
+    """
+    global _cached_flask_app
+    if _cached_flask_app is None:
+        from app import get_app
+        _cached_flask_app = get_app()
+    return _cached_flask_app
+
+
 def _make_retrieve_knowledge_tool():
     """
     Factory that returns a retrieve_knowledge FunctionTool for the ADK
@@ -75,8 +134,8 @@ def _make_retrieve_knowledge_tool():
     so no per-user API key is needed.
 
     The tool is declared ``async`` so ADK awaits it.  The actual DB + embedding
-    I/O is offloaded to a threadpool via run_in_executor so the LLM API
-    connection keepalive is not disrupted.
+    I/O is offloaded to the bounded RAG executor via run_in_executor so the
+    LLM API connection keepalive is not disrupted.
     """
 
     async def retrieve_knowledge(query: str) -> str:
@@ -103,16 +162,7 @@ def _make_retrieve_knowledge_tool():
         def _do_search():
             """Run the synchronous RAG query in a dedicated threadpool worker."""
             logger.info("[RAG-TOOL] retrieve_knowledge called | query=%r", query)
-            # Resolve which Flask app to use for the app context
-            flask_app = None
-            try:
-                from flask import current_app as _ca
-                flask_app = _ca._get_current_object()
-            except RuntimeError:
-                pass
-            if flask_app is None:
-                from app import get_app as _get_app
-                flask_app = _get_app()
+            flask_app = _resolve_flask_app()
 
             try:
                 from app.rag.retriever import search_knowledge, format_context
@@ -144,28 +194,40 @@ def _make_retrieve_knowledge_tool():
                 logger.warning("RAG retrieval failed: %s", exc)
                 return "Knowledge base retrieval is currently unavailable. Answer based on your general knowledge."
 
-        # Run synchronous DB + embedding call in a threadpool so that the ADK
+        # Run synchronous DB + embedding call in the RAG pool so that the ADK
         # async event loop is NOT blocked during the HTTP round-trip.
-        try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, _do_search)
-        except Exception as exc:
-            logger.warning("RAG retrieval failed: %s", exc)
-            return "Knowledge base retrieval is currently unavailable. Answer based on your general knowledge."
+        loop = asyncio.get_running_loop()
+        async with _get_rag_semaphore():
+            return await loop.run_in_executor(_rag_executor, _do_search)
 
     return retrieve_knowledge
 
 # Supported MIME types for file uploads
-SUPPORTED_MIME_TYPES = [
+# MIME type -> attachment category ('pdf', 'image' or 'video')
+_MIME_CATEGORY = {
     # PDF documents
-    'application/pdf',
+    'application/pdf': 'pdf',
     # Images
-    'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif',
+    **dict.fromkeys(
+        ('image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'),
+        'image',
+    ),
     # Videos
-    'video/mp4', 'video/mpeg', 'video/mov', 'video/quicktime', 'video/avi',
-    'video/x-msvideo', 'video/x-flv', 'video/mpg', 'video/webm',
-    'video/wmv', 'video/x-ms-wmv', 'video/3gpp', 'video/x-matroska'
-]
+    **dict.fromkeys(
+        ('video/mp4', 'video/mpeg', 'video/mov', 'video/quicktime', 'video/avi',
+         'video/x-msvideo', 'video/x-flv', 'video/mpg', 'video/webm',
+         'video/wmv', 'video/x-ms-wmv', 'video/3gpp', 'video/x-matroska'),
+        'video',
+    ),
+}
+SUPPORTED_MIME_TYPES = frozenset(_MIME_CATEGORY)
+
+# Routing hint appended to the current turn, per attachment category
+_ATTACHMENT_NOTES = (
+    ('pdf', "\n[Note: This request includes {count} PDF document(s) for analysis]"),
+    ('image', "\n[Note: This request includes {count} image file(s) for analysis]"),
+    ('video', "\n[Note: This request includes {count} video file(s) for analysis]"),
+)
 
 # Maximum file size (500MB)
 MAX_FILE_SIZE = 500 * 1024 * 1024
@@ -174,6 +236,52 @@ VIDEO_VERTEX_FALLBACK_TIMEOUT_SECONDS = int(
     os.environ.get('CHAT_VIDEO_FALLBACK_TIMEOUT_SECONDS', '120')
 )
 VIDEO_VERTEX_FALLBACK_MODEL = os.environ.get('CHAT_VIDEO_FALLBACK_MODEL', 'gemini-3-flash-preview')
+# Stream coalescing (the only buffering layer): merge model fragments until
+# this many characters are buffered or this many milliseconds have passed
+# since the last flush; a timer flushes even if no new fragment arrives
+# (STREAM_COALESCE_MIN_CHARS=0 forwards every fragment as it arrives)
+STREAM_COALESCE_MIN_CHARS = int(os.environ.get('STREAM_COALESCE_MIN_CHARS', '64'))
+STREAM_COALESCE_MAX_DELAY = int(os.environ.get('STREAM_COALESCE_MAX_DELAY_MS', '15')) / 1000
+_NO_RESPONSE_MESSAGE = "I apologize, but I couldn't generate a response. Please try again."
+# Admission control: ADK streams allowed to run at once in this process;
+# requests beyond it are turned away immediately instead of queueing
+MAX_INFLIGHT_STREAMS = int(os.environ.get('MAX_INFLIGHT_STREAMS', '64'))
+_SERVER_BUSY_MESSAGE = "Server busy: too many responses are being generated right now. Please try again in a moment."
+# Database URL for ADK sessions shared across workers and restarts (e.g. the
+# app's Postgres URL); unset keeps sessions in process memory
+ADK_SESSION_DB_URL = os.environ.get('ADK_SESSION_DB_URL')
+# Explicit Gemini context caching of the static agent prefix (instructions and
+# tools); prompts shorter than the minimum are sent uncached
+ADK_CONTEXT_CACHE_ENABLED = os.environ.get('ADK_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+ADK_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get('ADK_CONTEXT_CACHE_MIN_TOKENS', '4096'))
+ADK_CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('ADK_CONTEXT_CACHE_TTL_SECONDS', '3600'))
+# Worker threads that drive blocking Vertex AI streams (bounds concurrent calls)
+VERTEX_WORKERS = int(os.environ.get('VERTEX_WORKERS', '32'))
+# Keep-alive pool shared by every user's Gemini client (AI Studio keys)
+GEMINI_HTTP_MAX_KEEPALIVE = int(os.environ.get('GEMINI_HTTP_MAX_KEEPALIVE', '256'))
+GEMINI_HTTP_MAX_CONNECTIONS = int(os.environ.get('GEMINI_HTTP_MAX_CONNECTIONS', '512'))
+# Gemini Developer API attachments are passed as V4 signed GCS URLs so the
+# model fetches them itself; set to false to upload the bytes inline instead.
+# URLs stay in ADK session history, so the lifetime covers later turns too.
+GEMINI_SIGNED_URL_ATTACHMENTS = os.environ.get('GEMINI_SIGNED_URL_ATTACHMENTS', 'true').lower() == 'true'
+GEMINI_SIGNED_URL_TTL_MINUTES = int(os.environ.get('GEMINI_SIGNED_URL_TTL_MINUTES', '1440'))
+# Signed URLs and small attachment payloads reused across turns, keyed by
+# object generation so rewritten files are never served stale
+ATTACHMENT_CACHE_TTL_SECONDS = int(os.environ.get('ATTACHMENT_CACHE_TTL', '1800'))
+ATTACHMENT_CACHE_MAX_ENTRIES = int(os.environ.get('ATTACHMENT_CACHE_MAX_ENTRIES', '256'))
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+# Total attempts (first call included) for Gemini requests rejected with a
+# transient status before any output streamed; 1 disables retries
+GEMINI_RETRY_ATTEMPTS = int(os.environ.get('GEMINI_RETRY_ATTEMPTS', '3'))
+# Rendered conversation histories kept for reuse, one per session
+HISTORY_CACHE_MAX_ENTRIES = 4096
+# Upper bound on cached user/model agent+runner pairs (least recently used evicted first)
+AGENT_CACHE_MAX_USERS = int(os.environ.get('AGENT_CACHE_MAX_USERS', '1024'))
+# Cached agents unused for this long are dropped when the cache is next updated
+AGENT_CACHE_IDLE_SECONDS = int(os.environ.get('AGENT_CACHE_IDLE_SECONDS', '21600'))
+# Upper bound on tracked ADK sessions; the least recently used are forgotten
+# (and dropped from the in-memory session store) first
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', '4096'))
 
 
 def _is_google_search_enabled() -> bool:
@@ -183,6 +291,302 @@ def _is_google_search_enabled() -> bool:
     }
 
 
+def _build_generation_config(
+    temperature: float,
+    top_p: float,
+    max_output_tokens: int = 65536,
+) -> types.GenerateContentConfig:
+    """Return a generation config with the shared safety settings."""
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
+        safety_settings=[
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            ),
+        ],
+    )
+
+
+_CONTEXT_CACHE_CONFIG = ContextCacheConfig(
+    min_tokens=ADK_CONTEXT_CACHE_MIN_TOKENS,
+    ttl_seconds=ADK_CONTEXT_CACHE_TTL_SECONDS,
+) if ADK_CONTEXT_CACHE_ENABLED else None
+
+# Built once at import: ADK deep-copies an agent's generate_content_config
+# into each request, so the instances can be shared by every agent.
+# Keep specialists more deterministic, while coordinator remains conversational.
+_PDF_GENERATION_CONFIG = _build_generation_config(temperature=0.2, top_p=0.85)
+_MEDIA_GENERATION_CONFIG = _build_generation_config(temperature=0.55, top_p=0.9)
+_COORDINATOR_GENERATION_CONFIG = _build_generation_config(temperature=0.8, top_p=0.95)
+
+
+def _create_session_service() -> BaseSessionService:
+    """Return the ADK session store: database-backed when configured, else in-memory."""
+    if not ADK_SESSION_DB_URL:
+        return InMemorySessionService()
+
+    from google.adk.sessions import DatabaseSessionService
+    from sqlalchemy.pool import NullPool
+
+    # Every session call runs on the shared background loop. The engine is
+    # created at import, possibly before a worker fork, and async connections
+    # are bound to the loop that opened them, so they are not pooled.
+    service = DatabaseSessionService(
+        db_url=normalize_database_uri(ADK_SESSION_DB_URL),
+        poolclass=NullPool,
+    )
+    logger.info("Using database-backed ADK session service")
+    return service
+
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop used by sync callers, starting it on first use."""
+    global _background_loop
+
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever,
+                    name="chat-agent-loop",
+                    daemon=True,
+                ).start()
+                _background_loop = loop
+    return _background_loop
+
+
+def _run_on_background_loop(coro):
+    """Run a coroutine on the shared loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+
+# One connection pool for all key-bound Gemini clients so warm TLS connections
+# are reused across users and turns. The async client is only driven from the
+# shared background loop; HTTP/2 is used when the optional h2 package exists.
+_GEMINI_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=GEMINI_HTTP_MAX_KEEPALIVE,
+    max_connections=GEMINI_HTTP_MAX_CONNECTIONS,
+)
+_shared_httpx_client = httpx.Client(
+    follow_redirects=True,
+    limits=_GEMINI_HTTP_LIMITS,
+)
+_shared_httpx_async_client = httpx.AsyncClient(
+    http2=find_spec('h2') is not None,
+    follow_redirects=True,
+    limits=_GEMINI_HTTP_LIMITS,
+)
+
+
+@atexit.register
+def _close_shared_http_clients() -> None:
+    """Close the shared Gemini connection pools at interpreter exit."""
+    _shared_httpx_client.close()
+    loop = _background_loop
+    if loop is None or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(
+            _shared_httpx_async_client.aclose(), loop
+        ).result(timeout=5)
+    except Exception as exc:
+        logger.debug("Could not close shared Gemini HTTP client: %s", exc)
+
+
+async def _next_item(agen) -> tuple:
+    """Advance an async generator; returns (done, item)."""
+    try:
+        return False, await agen.__anext__()
+    except StopAsyncIteration:
+        return True, None
+
+
+async def _aclose_quietly(agen) -> None:
+    """Close an async generator, logging instead of raising on teardown errors."""
+    try:
+        await agen.aclose()
+    except Exception as exc:
+        logger.debug("Async stream teardown failed: %s", exc)
+
+
+def _iterate_on_background_loop(agen) -> Generator[Any, None, None]:
+    """
+    Consume an async generator from sync code via the shared background loop.
+    
+    Each item is awaited on the loop and handed back directly, so no extra
+    thread or event loop is created per stream and exceptions propagate to the
+    caller. Under green-thread servers the wait polls so the hub keeps running.
+    If the consumer goes away mid-wait, the pending step is cancelled so the
+    stream and its HTTP connection do not keep running on the loop.
+    """
+    loop = _get_background_loop()
+    from app import socketio
+    green_mode = getattr(socketio, 'async_mode', None) in {'eventlet', 'gevent', 'gevent_uwsgi'}
+    future = None
+    try:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(_next_item(agen), loop)
+            if green_mode:
+                while not future.done():
+                    # Yield control to the hub so other requests can proceed
+                    socketio.sleep(0.01)
+            done, item = future.result()
+            if done:
+                return
+            yield item
+    finally:
+        if future is not None and not future.done():
+            # Cancellation is delivered before the close below is scheduled
+            future.cancel()
+        # Closing runs the generator's cleanup (e.g. ADK span/session teardown)
+        asyncio.run_coroutine_threadsafe(_aclose_quietly(agen), loop)
+
+
+async def _aiterate_on_background_loop(agen) -> AsyncIterator[Any]:
+    """
+    Consume an async generator from another event loop via the shared loop.
+    
+    Async callers get the same single-loop guarantee as sync ones: loop-bound
+    resources (the shared httpx AsyncClient, session connections) are only
+    ever used from the background loop. Cancellation of the caller cancels
+    the pending step and closes the generator there.
+    """
+    loop = _get_background_loop()
+    if asyncio.get_running_loop() is loop:
+        async for item in agen:
+            yield item
+        return
+    future = None
+    try:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(_next_item(agen), loop)
+            done, item = await asyncio.wrap_future(future)
+            if done:
+                return
+            yield item
+    finally:
+        if future is not None and not future.done():
+            future.cancel()
+        asyncio.run_coroutine_threadsafe(_aclose_quietly(agen), loop)
+
+
+class _ApiKeyGemini(Gemini):
+    """Gemini model bound to one user's AI Studio API key.
+
+    ADK's Gemini builds its genai Client from process environment variables;
+    binding the key here keeps concurrent users from sharing GOOGLE_API_KEY
+    and lets the agent reuse one client across turns. Every client sends over
+    the process-wide connection pool instead of opening its own.
+    """
+
+    api_key: Optional[str] = Field(default=None, repr=False, exclude=True)
+
+    @cached_property
+    def api_client(self) -> Client:
+        return Client(
+            api_key=self.api_key,
+            vertexai=False,
+            http_options=types.HttpOptions(
+                headers=self._tracking_headers(),
+                retry_options=self.retry_options,
+                httpx_client=_shared_httpx_client,
+                httpx_async_client=_shared_httpx_async_client,
+            ),
+        )
+
+
+class _VertexGemini(Gemini):
+    """Gemini model bound to one user's Vertex AI project or express-mode key.
+
+    Configuring ADK through GOOGLE_GENAI_USE_VERTEXAI and related variables
+    meant rewriting process environment on every request, which raced between
+    concurrent users; the settings are passed to the client directly instead.
+    """
+
+    project: Optional[str] = Field(default=None, exclude=True)
+    location: Optional[str] = Field(default=None, exclude=True)
+    api_key: Optional[str] = Field(default=None, repr=False, exclude=True)
+    credentials_key: str = Field(default='', repr=False, exclude=True)
+
+    @cached_property
+    def api_client(self) -> Client:
+        return Client(
+            vertexai=True,
+            project=self.project,
+            location=self.location,
+            api_key=self.api_key,
+            # None falls back to application default credentials (Cloud Run)
+            credentials=_vertex_credentials.get(self.credentials_key),
+            http_options=types.HttpOptions(
+                headers=self._tracking_headers(),
+                retry_options=self.retry_options,
+                httpx_client=_shared_httpx_client,
+                httpx_async_client=_shared_httpx_async_client,
+            ),
+        )
+
+
+# Retried inside the genai client, so the same serialized request is resent and
+# ADK does not record the user turn a second time
+_GEMINI_RETRY_OPTIONS = types.HttpRetryOptions(
+    attempts=max(1, GEMINI_RETRY_ATTEMPTS),
+    initial_delay=0.25,
+    max_delay=4.0,
+    jitter=0.25,
+    http_status_codes=[429, 500, 502, 503, 504],
+)
+
+
+def _resolve_agent_model(
+    api_key: str,
+    model_name: str,
+    vertex_settings: Optional[Dict[str, Any]] = None,
+):
+    """Return the model for an agent: a key- or project-bound Gemini, else the name."""
+    if not api_key and not vertex_settings:
+        return model_name
+    try:
+        if not issubclass(LLMRegistry.resolve(model_name), Gemini):
+            return model_name
+    except ValueError:
+        return model_name
+    if vertex_settings:
+        return _VertexGemini(
+            model=model_name, retry_options=_GEMINI_RETRY_OPTIONS, **vertex_settings
+        )
+    return _ApiKeyGemini(model=model_name, api_key=api_key, retry_options=_GEMINI_RETRY_OPTIONS)
+
+
+@dataclass(slots=True)
+class _AgentRuntime:
+    """Cached coordinator agent, its Runner, and the API key it was built with."""
+    agent: Agent
+    runner: Runner
+    api_key: str
+    # time.monotonic() of the last lookup; written without the manager lock
+    last_used: float = 0.0
+
+
 class ChatAgentManager:
     """
     Manages ADK chat agents for user sessions.
@@ -197,12 +601,19 @@ class ChatAgentManager:
     # App name constant for ADK Runner (must match agent package structure)
     APP_NAME = "agents"
     
-    def __init__(self):
-        self._agents: Dict[str, Agent] = {}
-        self._session_service = InMemorySessionService()
-        self._runners: Dict[str, Runner] = {}
-        self._api_keys: Dict[str, str] = {}  # Cache API keys per user to avoid global env pollution
-        self._created_sessions: set = set()  # Track created sessions
+    def __init__(self, max_users: int = AGENT_CACHE_MAX_USERS):
+        self._max_users = max(1, max_users)
+        # Guards every cache below; reentrant because clearing helpers nest
+        self._lock = threading.RLock()
+        # (user_id, model_name) -> agent/runner pair; read without the lock,
+        # mutated only while holding it
+        self._runtimes: Dict[Tuple[str, str], _AgentRuntime] = {}
+        self._session_service = _create_session_service()
+        # Created sessions as (app_name, user_id, session_id), least recently used first
+        self._created_sessions: "OrderedDict[Tuple[str, str, str], None]" = OrderedDict()
+        # Session key -> last user message the session answered, used to tell
+        # whether its events already cover the caller's history
+        self._session_last_messages: Dict[Tuple[str, str, str], str] = {}
 
     def _build_coordinator_tools(self) -> List[Any]:
         """Assemble coordinator tools with optional web search capability."""
@@ -213,7 +624,12 @@ class ChatAgentManager:
 
         return tools
     
-    def _create_agent(self, api_key: str, model_name: str = "gemini-3-flash") -> Agent:
+    def _create_agent(
+        self,
+        api_key: str,
+        model_name: str = "gemini-3-flash",
+        vertex_settings: Optional[Dict[str, Any]] = None,
+    ) -> Agent:
         """
         Create a new ADK Agent with the specified configuration.
         This creates a multi-agent system with:
@@ -224,137 +640,113 @@ class ChatAgentManager:
         Args:
             api_key: Google AI API key
             model_name: The Gemini model to use
+            vertex_settings: Vertex AI client settings (project, location,
+                api_key, credentials_key); None for AI Studio
             
         Returns:
             Configured Agent instance (coordinator with sub-agents)
         """
-        # Store API key for later use (avoid setting in os.environ for thread safety)
-        # Only set for AI Studio; Vertex AI uses GOOGLE_GENAI_USE_VERTEXAI instead
-        if api_key and api_key != "vertex-ai-backend":
-            os.environ['GOOGLE_API_KEY'] = api_key
+        # One model instance (and genai client) shared by all three agents
+        model = _resolve_agent_model(api_key, model_name, vertex_settings)
         
-        def _build_generation_config(
-            temperature: float,
-            top_p: float,
-            max_output_tokens: int = 65536,
-        ) -> types.GenerateContentConfig:
-            """Return a fresh generation config instance for each sub-agent."""
-            return types.GenerateContentConfig(
-                temperature=temperature,
-                top_p=top_p,
-                max_output_tokens=max_output_tokens,
-                safety_settings=[
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    ),
-                ],
-            )
-
-        # Keep specialists more deterministic, while coordinator remains conversational.
-        pdf_generation_config = _build_generation_config(
-            temperature=0.2,
-            top_p=0.85,
-        )
-        media_generation_config = _build_generation_config(
-            temperature=0.55,
-            top_p=0.9,
-        )
-        coordinator_generation_config = _build_generation_config(
-            temperature=0.8,
-            top_p=0.95,
-        )
         coordinator_tools = self._build_coordinator_tools()
         
         # Create the PDF analysis agent (analyzes PDFs, returns results to coordinator)
         pdf_agent = Agent(
             name="pdf_agent",
-            model=model_name,
+            model=model,
             description="Specialist for analyzing PDF documents and returning structured analysis results to the coordinator",
             instruction=PDF_AGENT_INSTRUCTION,
-            generate_content_config=pdf_generation_config,
+            generate_content_config=_PDF_GENERATION_CONFIG,
         )
         
         # Create the media analysis agent (analyzes images/videos, returns results to coordinator)
         media_agent = Agent(
             name="media_agent",
-            model=model_name,
+            model=model,
             description="Specialist for analyzing images and videos and returning structured analysis results to the coordinator",
             instruction=MEDIA_AGENT_INSTRUCTION,
-            generate_content_config=media_generation_config,
+            generate_content_config=_MEDIA_GENERATION_CONFIG,
         )
         
         # Create the coordinator agent (routes tasks, receives results, interacts with users)
         coordinator_agent = Agent(
             name="steup_growth_coordinator",
-            model=model_name,
+            model=model,
             description="Steup Growth coordinator that manages conversations, delegates analysis tasks, receives results from specialists, and interacts directly with users",
             instruction=COORDINATOR_AGENT_INSTRUCTION,
-            generate_content_config=coordinator_generation_config,
+            generate_content_config=_COORDINATOR_GENERATION_CONFIG,
             tools=coordinator_tools,
             sub_agents=[pdf_agent, media_agent],  # Register sub-agents
         )
         
         return coordinator_agent
     
-    def get_or_create_agent(self, user_id: str, api_key: str, model_name: str = "gemini-3-flash", _numeric_user_id: Optional[int] = None) -> Agent:
+    def get_runtime(
+        self,
+        user_id: str,
+        api_key: str,
+        model_name: str = "gemini-3-flash",
+        vertex_settings: Optional[Dict[str, Any]] = None,
+    ) -> _AgentRuntime:
         """
-        Get an existing agent for a user or create a new one.
+        Get the cached agent and Runner for a user/model, creating them if needed.
         
         Args:
             user_id: Unique user identifier
-            api_key: Google AI API key
+            api_key: Google AI API key, or a fingerprint of the Vertex settings
             model_name: The Gemini model to use
+            vertex_settings: Vertex AI client settings; None for AI Studio
             
         Returns:
-            Agent instance for the user
+            Runtime holding the Agent and Runner for the user
         """
-        agent_key = f"{user_id}_{model_name}"
-        
-        # Store API key per user for later retrieval
-        self._api_keys[user_id] = api_key
-        
-        # Check if we need to create a new agent (different model or new user)
-        if agent_key not in self._agents:
-            self._agents[agent_key] = self._create_agent(api_key, model_name)
+        key = (user_id, model_name)
         
-        return self._agents[agent_key]
-    
-    def get_or_create_runner(self, user_id: str, api_key: str, model_name: str = "gemini-3-flash") -> Runner:
-        """
-        Get or create a Runner for the user's agent.
+        # Fast path: dict reads are atomic, so cache hits never take the lock
+        runtime = self._runtimes.get(key)
+        if runtime is not None and runtime.api_key == api_key:
+            runtime.last_used = time.monotonic()
+            return runtime
         
-        Args:
-            user_id: Unique user identifier
-            api_key: Google AI API key
-            model_name: The Gemini model to use
+        with self._lock:
+            # Another thread may have built it while we waited for the lock
+            runtime = self._runtimes.get(key)
+            if runtime is not None and runtime.api_key == api_key:
+                runtime.last_used = time.monotonic()
+                return runtime
             
-        Returns:
-            Runner instance for the agent
-        """
-        runner_key = f"{user_id}_{model_name}"
-        
-        if runner_key not in self._runners:
-            agent = self.get_or_create_agent(user_id, api_key, model_name)
-            self._runners[runner_key] = Runner(
+            # Agents are bound to the key they were built with; rebuild on change
+            for stale_key in [
+                k for k, rt in self._runtimes.items() if k[0] == user_id and rt.api_key != api_key
+            ]:
+                del self._runtimes[stale_key]
+            
+            # Different model or new user
+            agent = self._create_agent(api_key, model_name, vertex_settings)
+            # Wrapping the agent in an App enables ADK's context caching
+            app = App(
+                name=self.APP_NAME,
+                root_agent=agent,
+                context_cache_config=_CONTEXT_CACHE_CONFIG,
+            )
+            runtime = _AgentRuntime(
                 agent=agent,
-                app_name=self.APP_NAME,
-                session_service=self._session_service
+                runner=Runner(app=app, session_service=self._session_service),
+                api_key=api_key,
+                last_used=time.monotonic(),
             )
-        
-        return self._runners[runner_key]
+            self._evict_stale_runtimes()
+            self._runtimes[key] = runtime
+            return runtime
+    
+    def get_or_create_agent(self, user_id: str, api_key: str, model_name: str = "gemini-3-flash", _numeric_user_id: Optional[int] = None) -> Agent:
+        """Get an existing agent for a user or create a new one."""
+        return self.get_runtime(user_id, api_key, model_name).agent
+    
+    def get_or_create_runner(self, user_id: str, api_key: str, model_name: str = "gemini-3-flash") -> Runner:
+        """Get or create a Runner for the user's agent."""
+        return self.get_runtime(user_id, api_key, model_name).runner
     
     def get_session_id(self, user_id: str, conversation_id: Optional[int] = None) -> str:
         """
@@ -374,77 +766,147 @@ class ChatAgentManager:
             # Fallback for cases without a conversation (e.g., quick queries)
             return f"temp_{user_id}"
     
-    def ensure_session_exists(self, user_id: str, session_id: str) -> None:
+    async def ensure_session_exists_async(self, user_id: str, session_id: str) -> None:
         """
-        Ensure a session exists in the session service, creating it if necessary.
+        Ensure a session exists in the session service asynchronously.
         
         Args:
             user_id: Unique user identifier
             session_id: The session ID to ensure exists
         """
-        session_key = f"{self.APP_NAME}_{user_id}_{session_id}"
+        session_key = (self.APP_NAME, user_id, session_id)
         
-        if session_key not in self._created_sessions:
-            # Create the session using async method in sync context
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+        if not self._touch_session(session_key):
+            # Create the session asynchronously
             try:
-                loop.run_until_complete(
-                    self._session_service.create_session(
-                        app_name=self.APP_NAME,
-                        user_id=user_id,
-                        session_id=session_id,
-                        state={}
-                    )
+                await self._session_service.create_session(
+                    app_name=self.APP_NAME,
+                    user_id=user_id,
+                    session_id=session_id,
+                    state={}
                 )
-                self._created_sessions.add(session_key)
                 logger.info(f"Created new session: {session_id} for user: {user_id}")
-            finally:
-                loop.close()
+            except AlreadyExistsError:
+                # Persisted by another worker or before a restart
+                pass
+            self._track_session(session_key)
     
-    async def ensure_session_exists_async(self, user_id: str, session_id: str) -> None:
-        """
-        Ensure a session exists in the session service asynchronously.
+    def _touch_session(self, session_key: Tuple[str, str, str]) -> bool:
+        """Mark a tracked session as recently used; False if it is not tracked."""
+        with self._lock:
+            if session_key not in self._created_sessions:
+                return False
+            self._created_sessions.move_to_end(session_key)
+            return True
+    
+    def _track_session(self, session_key: Tuple[str, str, str]) -> None:
+        """Record a created session, forgetting the least recently used overflow."""
+        with self._lock:
+            self._created_sessions[session_key] = None
+            self._created_sessions.move_to_end(session_key)
+            while len(self._created_sessions) > max(1, SESSION_CACHE_MAX_ENTRIES):
+                evicted_key, _ = self._created_sessions.popitem(last=False)
+                self._session_last_messages.pop(evicted_key, None)
+                self._release_session(evicted_key)
+    
+    def _release_session(self, session_key: Tuple[str, str, str]) -> None:
+        """Free an evicted session's events when they only live in memory.
         
-        Args:
-            user_id: Unique user identifier
-            session_id: The session ID to ensure exists
+        Database-backed sessions are kept; they are recreated-or-found on next use.
+        """
+        if not isinstance(self._session_service, InMemorySessionService):
+            return
+        app_name, user_id, session_id = session_key
+        # Fire and forget: the caller may itself be running on the shared loop
+        asyncio.run_coroutine_threadsafe(
+            self._session_service.delete_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            ),
+            _get_background_loop(),
+        )
+        logger.debug(f"Evicted cached session: {session_id} for user: {user_id}")
+    
+    def session_has_history(
+        self,
+        user_id: str,
+        session_id: str,
+        history: Optional[List[Dict[str, Any]]],
+        message: Optional[str] = None,
+    ) -> bool:
         """
-        session_key = f"{self.APP_NAME}_{user_id}_{session_id}"
+        Return whether the ADK session already holds the turns in ``history``.
         
-        if session_key not in self._created_sessions:
-            # Create the session asynchronously
-            await self._session_service.create_session(
-                app_name=self.APP_NAME,
-                user_id=user_id,
-                session_id=session_id,
-                state={}
-            )
-            self._created_sessions.add(session_key)
-            logger.info(f"Created new session: {session_id} for user: {user_id}")
+        True when the newest earlier user message in the history is the last
+        one this session answered, so only the new message needs to be sent.
+        ``message`` is the current turn, which clients may already have
+        appended to ``history``.
+        """
+        last_message = _last_user_message(history, message)
+        if last_message is None:
+            return False
+        with self._lock:
+            return self._session_last_messages.get((self.APP_NAME, user_id, session_id)) == last_message
+    
+    def record_session_turn(self, user_id: str, session_id: str, message: Optional[str]) -> None:
+        """Remember the user message a session just answered."""
+        if not message:
+            return
+        with self._lock:
+            self._session_last_messages[(self.APP_NAME, user_id, session_id)] = message
     
     def get_api_key(self, user_id: str) -> Optional[str]:
         """Get cached API key for a user."""
-        return self._api_keys.get(user_id)
+        with self._lock:
+            for (runtime_user_id, _), runtime in self._runtimes.items():
+                if runtime_user_id == user_id:
+                    return runtime.api_key
+        return None
     
-    def clear_user_agents(self, user_id: str):
-        """Clear all agents and cached data for a specific user."""
-        keys_to_remove = [key for key in self._agents.keys() if key.startswith(f"{user_id}_")]
-        for key in keys_to_remove:
-            del self._agents[key]
-        
-        runner_keys_to_remove = [key for key in self._runners.keys() if key.startswith(f"{user_id}_")]
-        for key in runner_keys_to_remove:
-            del self._runners[key]
+    def _drop_user_agents(self, user_id: str) -> None:
+        """Forget cached agents and runners for a user (sessions are kept)."""
+        with self._lock:
+            for key in [key for key in self._runtimes if key[0] == user_id]:
+                del self._runtimes[key]
+    
+    def clear_attachment_cache(self) -> None:
+        """Drop cached signed URLs and attachment bytes (e.g. after files change)."""
+        clear_attachment_cache()
+    
+    def discard_agent(self, user_id: str, model_name: str) -> None:
+        """Drop one cached agent/runner pair so the next request rebuilds it."""
+        with self._lock:
+            self._runtimes.pop((user_id, model_name), None)
+    
+    def _evict_stale_runtimes(self) -> None:
+        """
+        Drop idle runtimes and make room for one more; caller holds the lock.
         
-        # Clear API key cache
-        if user_id in self._api_keys:
-            del self._api_keys[user_id]
+        Runs only when a runtime is about to be added, so hits stay lock-free.
+        Sessions stay tracked because they still exist in the session service.
+        """
+        idle_before = time.monotonic() - AGENT_CACHE_IDLE_SECONDS
+        for key in [k for k, rt in self._runtimes.items() if rt.last_used < idle_before]:
+            del self._runtimes[key]
+            logger.debug(f"Evicted idle cached agent: {key[0]}_{key[1]}")
         
-        # Clear tracked sessions for this user
-        sessions_to_remove = [s for s in self._created_sessions if f"_{user_id}_" in s]
-        for session_key in sessions_to_remove:
-            self._created_sessions.discard(session_key)
+        overflow = len(self._runtimes) + 1 - self._max_users
+        if overflow > 0:
+            by_age = sorted(self._runtimes, key=lambda k: self._runtimes[k].last_used)
+            for key in by_age[:overflow]:
+                del self._runtimes[key]
+                logger.debug(f"Evicted cached agent: {key[0]}_{key[1]}")
+    
+    def clear_user_agents(self, user_id: str):
+        """Clear all agents and cached data for a specific user."""
+        with self._lock:
+            # Cached API keys live on the runtimes and go with them
+            self._drop_user_agents(user_id)
+            
+            # Clear tracked sessions for this user
+            sessions_to_remove = [s for s in self._created_sessions if s[1] == user_id]
+            for session_key in sessions_to_remove:
+                self._created_sessions.pop(session_key, None)
+                self._session_last_messages.pop(session_key, None)
     
     def clear_conversation_session(self, user_id: str, conversation_id: int):
         """
@@ -456,26 +918,23 @@ class ChatAgentManager:
             conversation_id: Database conversation ID
         """
         session_id = self.get_session_id(user_id, conversation_id)
-        session_key = f"{self.APP_NAME}_{user_id}_{session_id}"
+        session_key = (self.APP_NAME, user_id, session_id)
         
         # Remove from tracked sessions
-        self._created_sessions.discard(session_key)
+        with self._lock:
+            self._created_sessions.pop(session_key, None)
+            self._session_last_messages.pop(session_key, None)
         
-        # Try to delete from session service using async method
+        # Try to delete from session service on the shared loop
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(
-                    self._session_service.delete_session(
-                        app_name=self.APP_NAME,
-                        user_id=user_id,
-                        session_id=session_id
-                    )
+            _run_on_background_loop(
+                self._session_service.delete_session(
+                    app_name=self.APP_NAME,
+                    user_id=user_id,
+                    session_id=session_id
                 )
-                logger.info(f"Deleted session: {session_id} for user: {user_id}")
-            finally:
-                loop.close()
+            )
+            logger.info(f"Deleted session: {session_id} for user: {user_id}")
         except Exception as e:
             logger.warning(f"Failed to delete session {session_id}: {e}")
 
@@ -495,6 +954,15 @@ def _is_supported_mime_type(mime_type: str) -> bool:
     return normalized.startswith('video/')
 
 
+def _mime_category(mime_type: Optional[str]) -> Optional[str]:
+    """Return 'pdf', 'image' or 'video' for an attachment MIME type, else None."""
+    normalized = (mime_type or '').strip().lower()
+    category = _MIME_CATEGORY.get(normalized)
+    if category is None and normalized.startswith(('image/', 'video/')):
+        category = normalized.split('/', 1)[0]
+    return category
+
+
 def _normalize_file_attachments(
     image_path: Optional[str] = None,
     image_mime_type: Optional[str] = None,
@@ -644,6 +1112,21 @@ def _validate_file(image_mime_type: str, file_size: int) -> Optional[str]:
     return None
 
 
+def _resolve_mime_type(mime_type: Optional[str], stored_content_type: Optional[str]) -> Optional[str]:
+    """Prefer the object's stored content type when the extension gave no answer."""
+    if (not mime_type or mime_type == 'application/octet-stream') and stored_content_type:
+        return stored_content_type.split(';', 1)[0].strip().lower()
+    return mime_type
+
+
+def _precheck_mime_type(mime_type: Optional[str]) -> Optional[str]:
+    """Reject a known-unsupported type before any storage round trip."""
+    if not mime_type or mime_type == 'application/octet-stream':
+        # Undecided until the object's stored content type is known
+        return None
+    return _validate_file(mime_type, 0)
+
+
 def _download_file_from_gcs(image_path: str) -> Optional[tuple]:
     """
     Download file from GCS and return data with size.
@@ -658,10 +1141,211 @@ def _download_file_from_gcs(image_path: str) -> Optional[tuple]:
         file_data = gcp_bucket.download_file_from_gcs(image_path)
         logger.info(f"Downloaded file: size={len(file_data)} bytes")
         return file_data, len(file_data)
+    except Exception:
+        logger.exception("Error downloading file from GCS")
+        return None
+
+
+def _stat_file_in_gcs(image_path: str) -> Optional[tuple]:
+    """
+    Resolve a stored file to its gs:// URI and size without downloading it.
+    
+    Args:
+        image_path: GCS path to the file
+        
+    Returns:
+        Tuple of (gs_uri, file_size, generation, content_type) or None on error
+    """
+    try:
+        gs_uri, file_size, generation, content_type = gcp_bucket.get_gcs_object_info(image_path)
+        logger.info(f"Resolved file: uri={gs_uri}, size={file_size} bytes")
+        return gs_uri, file_size, generation, content_type
+    except Exception as e:
+        logger.error(f"Error reading file metadata from GCS: {e}")
+        return None
+
+
+def _sign_gcs_uri(gs_uri: str) -> Optional[str]:
+    """
+    Create a time-limited HTTPS URL the Gemini API can fetch the object from.
+    
+    Args:
+        gs_uri: gs://bucket/key URI of the stored file
+        
+    Returns:
+        Signed URL, or None when the credentials cannot sign
+    """
+    bucket_name, _, storage_key = gs_uri[len('gs://'):].partition('/')
+    try:
+        return gcp_bucket.generate_signed_url(
+            storage_key,
+            bucket_name=bucket_name,
+            expiration_minutes=GEMINI_SIGNED_URL_TTL_MINUTES,
+        )
     except Exception as e:
-        logger.error(f"Error downloading file from GCS: {e}")
-        traceback.print_exc()
+        logger.warning(f"Could not sign {gs_uri}, sending bytes instead: {e}")
+        return None
+
+
+def _file_part(file_uri: str, mime_type: str) -> types.Part:
+    """Build a file-reference part without re-running pydantic validation."""
+    return types.Part.model_construct(
+        file_data=types.FileData.model_construct(file_uri=file_uri, mime_type=mime_type)
+    )
+
+
+_attachment_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_attachment_cache_lock = threading.Lock()
+
+
+def _get_cached_attachment(key: tuple) -> Any:
+    """Return a cached signed URL or file payload that has not expired."""
+    if ATTACHMENT_CACHE_TTL_SECONDS <= 0:
         return None
+    with _attachment_cache_lock:
+        entry = _attachment_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del _attachment_cache[key]
+            return None
+        _attachment_cache.move_to_end(key)
+        return value
+
+
+def _store_cached_attachment(key: tuple, value: Any, ttl: float) -> None:
+    """Cache a signed URL or file payload, evicting the least recently used entries."""
+    if ATTACHMENT_CACHE_TTL_SECONDS <= 0 or not value:
+        return
+    with _attachment_cache_lock:
+        _attachment_cache[key] = (time.monotonic() + ttl, value)
+        _attachment_cache.move_to_end(key)
+        while len(_attachment_cache) > ATTACHMENT_CACHE_MAX_ENTRIES:
+            _attachment_cache.popitem(last=False)
+
+
+def clear_attachment_cache() -> None:
+    """Forget all cached signed URLs and attachment payloads."""
+    with _attachment_cache_lock:
+        _attachment_cache.clear()
+
+
+# Long-lived workers so each keeps its thread-local GCS client between requests
+_attachment_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-attachment")
+
+
+def _build_attachment_part(attachment: Dict[str, Any], use_uri: bool) -> tuple:
+    """
+    Validate one attachment and turn it into a content part.
+    
+    Args:
+        attachment: Normalized attachment ({path, mime_type})
+        use_uri: Reference the gs:// object (Vertex AI) instead of sending bytes
+        
+    Returns:
+        Tuple of (part, error_message); exactly one of them is None
+    """
+    attachment_path = attachment.get('path')
+    attachment_mime = attachment.get('mime_type')
+    logger.info("Processing file: path=%s, mime_type=%s", attachment_path, attachment_mime)
+
+    validation_error = _precheck_mime_type(attachment_mime)
+    if validation_error:
+        return None, validation_error
+
+    # Validate from object metadata before any bytes are transferred
+    result = _stat_file_in_gcs(attachment_path)
+    if result is None:
+        return None, "Error: Failed to access file in storage."
+    gs_uri, file_size, generation, content_type = result
+    attachment_mime = _resolve_mime_type(attachment_mime, content_type)
+    
+    validation_error = _validate_file(attachment_mime, file_size)
+    if validation_error:
+        return None, validation_error
+    
+    if use_uri:
+        # Vertex AI reads gs:// objects directly
+        return _file_part(gs_uri, attachment_mime), None
+    
+    if GEMINI_SIGNED_URL_ATTACHMENTS:
+        # The Gemini Developer API cannot read gs:// but fetches signed URLs
+        url_key = ('url', gs_uri, generation)
+        signed_url = _get_cached_attachment(url_key)
+        if signed_url is None:
+            signed_url = _sign_gcs_uri(gs_uri)
+            # Reuse a URL for at most half its lifetime so it never expires mid-request
+            _store_cached_attachment(
+                url_key, signed_url,
+                min(ATTACHMENT_CACHE_TTL_SECONDS, GEMINI_SIGNED_URL_TTL_MINUTES * 30),
+            )
+        if signed_url:
+            return _file_part(signed_url, attachment_mime), None
+    
+    # Fall back to sending the bytes inline
+    bytes_key = ('bytes', gs_uri, generation)
+    file_data = _get_cached_attachment(bytes_key)
+    if file_data is None:
+        result = _download_file_from_gcs(attachment_path)
+        if result is None:
+            return None, "Error: Failed to download file from storage."
+        file_data = result[0]
+        if len(file_data) <= ATTACHMENT_CACHE_MAX_BYTES:
+            _store_cached_attachment(bytes_key, file_data, ATTACHMENT_CACHE_TTL_SECONDS)
+    return types.Part.model_construct(
+        inline_data=types.Blob.model_construct(data=file_data, mime_type=attachment_mime)
+    ), None
+
+
+def _build_attachment_parts(attachments: List[Dict[str, Any]], use_uri: bool) -> tuple:
+    """
+    Fetch and validate all attachments concurrently, keeping their order.
+    
+    Returns:
+        Tuple of (parts, error_message); the first error wins and parts is empty
+    """
+    if len(attachments) > 1:
+        results = list(_attachment_executor.map(
+            lambda attachment: _build_attachment_part(attachment, use_uri), attachments
+        ))
+    else:
+        results = [_build_attachment_part(attachment, use_uri) for attachment in attachments]
+
+    for _, error in results:
+        if error:
+            return [], error
+    logger.info("Added %d file part(s) to contents", len(results))
+    return [part for part, _ in results], None
+
+
+# (pattern, message) pairs checked in order against the lowercased error text
+_ERROR_MESSAGES = (
+    (
+        re.compile(r"user location is not supported|failed_precondition"),
+        "I'm sorry, but the Google AI service is currently not available in your location. "
+        "This is a regional restriction imposed by Google. "
+        "Please try using a VPN service to connect from a supported region (like the US), "
+        "or consider using a different AI service.",
+    ),
+    (
+        re.compile(r"^(?=.*api key)(?=.*(?:invalid|unauthorized))", re.DOTALL),
+        "API key error: Please check that your Google AI API key is valid and has the necessary permissions. "
+        "You can verify your API key in the settings page.",
+    ),
+    (
+        re.compile(r"quota|rate limit|429|resource_exhausted"),
+        "API quota exceeded: You've reached the usage limit for your Google AI API key. "
+        "Please wait a few minutes before trying again, or check your API usage limits. "
+        "Pro models have stricter rate limits — try switching to Gemini Flash.",
+    ),
+    (
+        re.compile(r"servererror|server disconnected|remoteprotocolerror|remotedisconnected|50[0234]"),
+        "Server error: The AI model is temporarily unavailable or overloaded. "
+        "This can happen with preview/Pro models. "
+        "Please try again in a moment, or switch to Gemini Flash for more stable performance.",
+    ),
+)
 
 
 def _format_error_message(error: Exception) -> str:
@@ -674,27 +1358,106 @@ def _format_error_message(error: Exception) -> str:
     Returns:
         User-friendly error message string
     """
-    error_str = str(error).lower()
-    
-    if "user location is not supported" in error_str or "failed_precondition" in error_str:
-        return ("I'm sorry, but the Google AI service is currently not available in your location. "
-                "This is a regional restriction imposed by Google. "
-                "Please try using a VPN service to connect from a supported region (like the US), "
-                "or consider using a different AI service.")
-    elif "api key" in error_str and ("invalid" in error_str or "unauthorized" in error_str):
-        return ("API key error: Please check that your Google AI API key is valid and has the necessary permissions. "
-                "You can verify your API key in the settings page.")
-    elif "quota" in error_str or "rate limit" in error_str or "429" in error_str or "resource_exhausted" in error_str:
-        return ("API quota exceeded: You've reached the usage limit for your Google AI API key. "
-                "Please wait a few minutes before trying again, or check your API usage limits. "
-                "Pro models have stricter rate limits — try switching to Gemini Flash.")
-    elif any(kw in error_str for kw in ("servererror", "server disconnected", "remoteprotocolerror",
-                                         "remotedisconnected", "500", "502", "503", "504")):
-        return ("Server error: The AI model is temporarily unavailable or overloaded. "
-                "This can happen with preview/Pro models. "
-                "Please try again in a moment, or switch to Gemini Flash for more stable performance.")
-    else:
-        return f"Error: Failed to generate response. {str(error)}"
+    error_text = str(error)
+    error_str = error_text.lower()
+    for pattern, friendly_message in _ERROR_MESSAGES:
+        if pattern.search(error_str):
+            return friendly_message
+    return f"Error: Failed to generate response. {error_text}"
+
+
+_history_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+
+def _render_history(history: List[Dict[str, Any]]) -> str:
+    """Render conversation history as the 'Previous conversation context' block."""
+    try:
+        convo_lines: List[str] = []
+        # History items share one schema, so detect it once from the first item
+        first = history[0] if isinstance(history, list) else None
+        if isinstance(first, dict) and 'role' in first and 'content' in first:
+            convo_lines = [
+                f"Human: {item['content']}" if item['role'] == 'user' else f"AI: {item['content']}"
+                for item in history
+            ]
+        elif isinstance(first, dict) and 'user' in first and 'bot' in first:
+            convo_lines = [
+                line
+                for item in history
+                for line in (f"Human: {item['user']}", f"AI: {item['bot']}")
+            ]
+    except (KeyError, TypeError) as e:
+        logger.warning(f"Failed to process history for context: {e}")
+        return ""
+    
+    if not convo_lines:
+        return ""
+    return "Previous conversation context:\n" + "\n".join(convo_lines)
+
+
+def _history_role(item: Dict[str, Any]) -> Optional[str]:
+    """Return a history item's speaker: ``role`` (web client) or ``sender`` (socket path)."""
+    return item.get('role', item.get('sender'))
+
+
+def _last_user_message(
+    history: Optional[List[Dict[str, Any]]],
+    current_message: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Return the newest user message before the current turn, whatever the schema.
+    
+    Clients may append the message being sent to the history first; a
+    trailing user entry equal to ``current_message`` is that turn, not one
+    the session has answered, so it is skipped.
+    """
+    if not isinstance(history, list) or not history:
+        return None
+    try:
+        items = history
+        last = history[-1]
+        if (
+            current_message is not None
+            and 'bot' not in last
+            and _history_role(last) == 'user'
+            and last.get('content') == current_message
+        ):
+            items = history[:-1]
+        for item in reversed(items):
+            if 'user' in item and 'bot' in item:
+                return item['user']
+            if _history_role(item) == 'user':
+                return item.get('content')
+    except (AttributeError, TypeError):
+        pass
+    return None
+
+
+def _render_history_cached(history: List[Dict[str, Any]], cache_key: Optional[str]) -> str:
+    """
+    Render history, reusing the last rendering for this session when unchanged.
+    
+    The fingerprint is the history length plus a hash of the newest item, so a
+    cache hit costs O(1) instead of re-rendering every turn.
+    """
+    if cache_key is None or not isinstance(history, list):
+        return _render_history(history)
+    
+    fingerprint = (len(history), hash(json.dumps(history[-1], sort_keys=True, default=str)))
+    with _history_cache_lock:
+        entry = _history_cache.get(cache_key)
+        if entry is not None and entry[0] == fingerprint:
+            _history_cache.move_to_end(cache_key)
+            return entry[1]
+    
+    text = _render_history(history)
+    with _history_cache_lock:
+        _history_cache[cache_key] = (fingerprint, text)
+        _history_cache.move_to_end(cache_key)
+        while len(_history_cache) > HISTORY_CACHE_MAX_ENTRIES:
+            _history_cache.popitem(last=False)
+    return text
 
 
 def build_message_content(
@@ -723,7 +1486,40 @@ def build_message_content(
     Returns:
         Formatted message string with context
     """
+    return "\n".join(build_message_blocks(
+        message,
+        image_path=image_path,
+        image_mime_type=image_mime_type,
+        file_attachments=file_attachments,
+        history=history,
+        username=username,
+    ))
+
+
+def build_message_blocks(
+    message: str,
+    image_path: Optional[str] = None,
+    image_mime_type: Optional[str] = None,
+    file_attachments: Optional[List[Dict[str, Any]]] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    username: Optional[str] = None,
+    history_cache_key: Optional[str] = None
+) -> List[str]:
+    """
+    Build the message text as [context, current turn] blocks.
+    
+    The context block (username and history) only grows between turns, so
+    sending it as its own leading part keeps the request prefix byte-identical
+    for Gemini's implicit context caching; the volatile message comes last.
+    
+    Args:
+        history_cache_key: Session ID whose rendered history may be reused
+        
+    Returns:
+        Non-empty text blocks in prompt order
+    """
     content_parts = []
+    turn_parts = []
     
     # Add user info for personalization
     if username:
@@ -731,30 +1527,14 @@ def build_message_content(
     
     # Add conversation history as context if provided
     if history:
-        try:
-            convo_lines = ["Previous conversation context:"]
-            if isinstance(history, list):
-                for item in history:
-                    if isinstance(item, dict) and 'role' in item and 'content' in item:
-                        role = item.get('role')
-                        content = item.get('content', '')
-                        if role == 'user':
-                            convo_lines.append(f"Human: {content}")
-                        else:
-                            convo_lines.append(f"AI: {content}")
-                    elif isinstance(item, dict) and 'user' in item and 'bot' in item:
-                        convo_lines.append(f"Human: {item.get('user', '')}")
-                        convo_lines.append(f"AI: {item.get('bot', '')}")
-            
-            if len(convo_lines) > 1:
-                content_parts.append("\n".join(convo_lines))
-                content_parts.append("\nCurrent message:")
-        except Exception as e:
-            print(f"Failed to process history for context: {e}")
+        history_text = _render_history_cached(history, history_cache_key)
+        if history_text:
+            content_parts.append(history_text)
+            turn_parts.append("\nCurrent message:")
     
     # Add the main message
     if message:
-        content_parts.append(message)
+        turn_parts.append(message)
     
     # Add attachment summary to help the coordinator route specialist tasks.
     normalized_attachments = _normalize_file_attachments(
@@ -763,26 +1543,272 @@ def build_message_content(
         file_attachments=file_attachments,
     )
     if normalized_attachments:
-        pdf_count = 0
-        image_count = 0
-        video_count = 0
+        category_counts: Dict[str, int] = {}
         for attachment in normalized_attachments:
-            mime_type = (attachment.get('mime_type') or '').lower()
-            if mime_type == 'application/pdf':
-                pdf_count += 1
-            elif mime_type.startswith('image/'):
-                image_count += 1
-            elif mime_type.startswith('video/'):
-                video_count += 1
+            category = _mime_category(attachment.get('mime_type'))
+            if category:
+                category_counts[category] = category_counts.get(category, 0) + 1
+
+        for category, note in _ATTACHMENT_NOTES:
+            if category in category_counts:
+                turn_parts.append(note.format(count=category_counts[category]))
+    
+    return [block for block in ("\n".join(content_parts), "\n".join(turn_parts)) if block]
+
+
+_get_event_parts = operator.attrgetter('content.parts')
+
+
+def _extract_event_texts(event) -> List[str]:
+    """
+    Return the non-empty text fragments carried by one ADK event.
+    
+    ADK events (google-adk 1.24) carry text only in content.parts; there is
+    no top-level ``text`` field to fall back to.
+    """
+    try:
+        parts = _get_event_parts(event)
+    except AttributeError:
+        # content is None (e.g. state-delta or transfer events)
+        return []
+    if not parts:
+        return []
+    return [text for part in parts if (text := part.text)]
+
+
+async def _coalesce_chunks_async(
+    chunks,
+    min_chars: int = STREAM_COALESCE_MIN_CHARS,
+    max_delay: float = STREAM_COALESCE_MAX_DELAY,
+) -> AsyncIterator[str]:
+    """
+    Merge small streamed text fragments so each yield carries more text.
+    
+    Buffered text is flushed at ``min_chars`` or once ``max_delay`` has passed
+    since the last flush, even if the model pauses (e.g. during a tool call).
+    The source is drained by one pump task, so it always runs in one context
+    and a flush timeout never cancels it mid-step.
+    """
+    if min_chars <= 0:
+        async for text in chunks:
+            yield text
+        return
+    
+    items: asyncio.Queue = asyncio.Queue()
+    error: List[BaseException] = []
+    
+    async def _pump() -> None:
+        try:
+            async for text in chunks:
+                items.put_nowait(text)
+        except Exception as exc:
+            error.append(exc)
+        finally:
+            items.put_nowait(_STREAM_DONE)
+    
+    pump = asyncio.ensure_future(_pump())
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    buffered = 0
+    # Backdated so the first fragment goes out at once (time to first token)
+    last_flush = loop.time() - max_delay
+    try:
+        while True:
+            if buffer:
+                try:
+                    item = await asyncio.wait_for(
+                        items.get(), max(0.0, last_flush + max_delay - loop.time())
+                    )
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await items.get()
+            if item is _STREAM_DONE:
+                break
+            if item is not None:
+                buffer.append(item)
+                buffered += len(item)
+            now = loop.time()
+            if buffer and (buffered >= min_chars or now - last_flush >= max_delay):
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+                last_flush = now
+        if buffer:
+            yield "".join(buffer)
+        if error:
+            raise error[0]
+    finally:
+        if not pump.done():
+            # The consumer stopped early; stop the source where it is
+            pump.cancel()
+
 
-        if pdf_count:
-            content_parts.append(f"\n[Note: This request includes {pdf_count} PDF document(s) for analysis]")
-        if image_count:
-            content_parts.append(f"\n[Note: This request includes {image_count} image file(s) for analysis]")
-        if video_count:
-            content_parts.append(f"\n[Note: This request includes {video_count} video file(s) for analysis]")
+# A thread semaphore because streams are admitted from both the shared
+# background loop (sync callers) and callers' own event loops
+_inflight_streams = threading.BoundedSemaphore(max(1, MAX_INFLIGHT_STREAMS))
+
+_vertex_pool = ThreadPoolExecutor(max_workers=VERTEX_WORKERS, thread_name_prefix="vertex-stream")
+_STREAM_DONE = object()
+
+
+def _stream_in_worker(
+    produce: Callable[[], Iterable[str]],
+    min_chars: int = STREAM_COALESCE_MIN_CHARS,
+    max_delay: float = STREAM_COALESCE_MAX_DELAY,
+) -> Generator[str, None, None]:
+    """
+    Run a blocking text stream on the Vertex worker pool and relay its text.
+    
+    The bounded queue applies backpressure to the producer. Under green-thread
+    servers the consumer polls so the hub keeps scheduling other requests while
+    the worker waits on the network. Fragments are merged like
+    _coalesce_chunks_async, with the flush deadline enforced by the queue wait.
+    Exceptions from the producer are re-raised.
+    """
+    items: queue.Queue = queue.Queue(maxsize=64)
+    cancelled = threading.Event()
+    error: List[BaseException] = []
+
+    def _put(item) -> bool:
+        while not cancelled.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run() -> None:
+        try:
+            for item in produce():
+                if not _put(item):
+                    return
+        except BaseException as exc:
+            error.append(exc)
+        finally:
+            _put(_STREAM_DONE)
+
+    _vertex_pool.submit(_run)
+
+    from app import socketio
+    green_mode = getattr(socketio, 'async_mode', None) in {'eventlet', 'gevent', 'gevent_uwsgi'}
+    buffer: List[str] = []
+    buffered = 0
+    # Backdated so the first fragment goes out at once (time to first token)
+    last_flush = time.monotonic() - max_delay
+    try:
+        while True:
+            item = None
+            if green_mode:
+                # A blocking get() would stall the whole hub; poll cooperatively
+                try:
+                    item = items.get_nowait()
+                except queue.Empty:
+                    if not buffer or time.monotonic() - last_flush < max_delay:
+                        socketio.sleep(0.01)
+                        continue
+            else:
+                try:
+                    item = items.get(
+                        timeout=max(0.0, last_flush + max_delay - time.monotonic()) if buffer else None
+                    )
+                except queue.Empty:
+                    pass
+            if item is _STREAM_DONE:
+                break
+            if item is not None:
+                buffer.append(item)
+                buffered += len(item)
+            now = time.monotonic()
+            if buffer and (buffered >= min_chars or now - last_flush >= max_delay):
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+                last_flush = now
+    finally:
+        # Release the worker if the consumer stopped early
+        cancelled.set()
+
+    if buffer:
+        yield "".join(buffer)
+    if error:
+        raise error[0]
+
+
+# Parsed service-account credentials, one entry per distinct key (blake2b digest)
+_vertex_credentials: Dict[str, Any] = {}
+# vertexai.init() mutates process-wide state; serialize it with model creation
+_vertex_init_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _vertex_modules() -> tuple:
+    """Import the Vertex AI SDK on first use and return (vertexai, GenerativeModel, Part).
+    
+    The SDK is heavy, so it stays out of module import; after the first call
+    the per-request cost is a cache hit.
+    """
+    import vertexai
+    from vertexai.generative_models import GenerativeModel, Part
+    return vertexai, GenerativeModel, Part
+
+
+@lru_cache(maxsize=64)
+def _get_cached_vertex_model(sa_hash: str, project_id: str, location: str, model_name: str):
+    """Build a GenerativeModel whose API client is bound to one credential set."""
+    vertexai, GenerativeModel, _ = _vertex_modules()
+
+    with _vertex_init_lock:
+        vertexai.init(
+            project=project_id,
+            location=location,
+            credentials=_vertex_credentials.get(sa_hash),
+        )
+        model = GenerativeModel(model_name)
+        # The client is created lazily from the global config; create it now so
+        # a later init() for another project cannot change this model's
+        # credentials. The property is SDK-private, so only use it if present;
+        # a client-creation error propagates and is not cached.
+        if isinstance(getattr(type(model), '_prediction_client', None), cached_property):
+            model._prediction_client
+        else:
+            logger.warning(
+                "vertexai GenerativeModel has no cached _prediction_client; "
+                "model credentials follow the most recent vertexai.init()"
+            )
+    return model
+
+
+def _vertex_credentials_key(service_account_json: Any) -> str:
+    """Parse and cache service-account credentials; returns their key ('' for ADC)."""
+    if not service_account_json:
+        return ''
+    if not isinstance(service_account_json, str):
+        service_account_json = json.dumps(service_account_json)
+    sa_hash = hashlib.blake2b(service_account_json.encode(), digest_size=16).hexdigest()
+    if sa_hash not in _vertex_credentials:
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_info(
+            json.loads(service_account_json),
+            scopes=['https://www.googleapis.com/auth/cloud-platform']
+        )
+        _vertex_credentials.setdefault(sa_hash, credentials)
+    return sa_hash
+
+
+def _get_vertex_model(
+    service_account_json: Optional[str],
+    project_id: str,
+    location: str,
+    model_name: str,
+):
+    """Return a cached Vertex AI model for the given credentials and project.
     
-    return "\n".join(content_parts) if content_parts else ""
+    Cloud Run ADC is used when service_account_json is empty.
+    """
+    sa_hash = _vertex_credentials_key(service_account_json)
+    return _get_cached_vertex_model(sa_hash, project_id, location, model_name)
 
 
 def _generate_vertex_streaming_response(
@@ -822,47 +1848,34 @@ def _generate_vertex_streaming_response(
         return
     
     try:
-        # Initialize Vertex AI with service account
-        import vertexai
-        from vertexai.generative_models import GenerativeModel, Part, Content
-        # Initialize Vertex AI with explicit service account (local/custom) or
-        # Cloud Run ADC when service_account_json is not provided.
-        if service_account_json:
-            from google.oauth2 import service_account
-            service_account_info = json.loads(service_account_json)
-            credentials = service_account.Credentials.from_service_account_info(
-                service_account_info,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
-            vertexai.init(project=project_id, location=location, credentials=credentials)
-        else:
-            vertexai.init(project=project_id, location=location)
-        
-        # Build the content parts
-        content_parts = []
-        
-        # Build text content with history
-        text_content = build_message_content(
+        # Build text content with history; the SDK accepts plain strings, so
+        # text-only requests skip the Part wrappers entirely
+        content_parts: List[Any] = build_message_blocks(
             message,
             image_path=image_path,
             image_mime_type=image_mime_type,
             history=history,
             username=username,
         )
-        if text_content:
-            content_parts.append(Part.from_text(text_content))
         
         # Handle file uploads
         if image_path and image_mime_type:
+            _, _, Part = _vertex_modules()
             logger.info(f"Processing file for Vertex AI: path={image_path}, mime_type={image_mime_type}")
             
-            # Download and validate file
-            result = _download_file_from_gcs(image_path)
+            validation_error = _precheck_mime_type(image_mime_type)
+            if validation_error:
+                yield validation_error
+                return
+            
+            # Vertex AI reads the object from the bucket; only metadata is fetched here
+            result = _stat_file_in_gcs(image_path)
             if result is None:
-                yield "Error: Failed to download file from storage."
+                yield "Error: Failed to access file in storage."
                 return
             
-            file_data, file_size = result
+            gs_uri, file_size, _, content_type = result
+            image_mime_type = _resolve_mime_type(image_mime_type, content_type)
             
             # Validate file
             validation_error = _validate_file(image_mime_type, file_size)
@@ -871,42 +1884,177 @@ def _generate_vertex_streaming_response(
                 return
             
             # Add file part
-            content_parts.append(Part.from_data(data=file_data, mime_type=image_mime_type))
+            content_parts.append(Part.from_uri(uri=gs_uri, mime_type=image_mime_type))
             logger.info("File part added to Vertex AI request")
         
         if not content_parts:
             yield "Please provide a message or a file."
             return
         
-        # Create the model
-        model = GenerativeModel(model_name)
-        
-        # Generate streaming response
-        response = model.generate_content(
-            content_parts,
-            stream=True,
-            generation_config={
-                'temperature': 1.0,
-                'top_p': 0.95,
-                'max_output_tokens': 65536,
-            }
-        )
+        def _produce_texts() -> Generator[str, None, None]:
+            """Blocking part of the call: model setup, prefill and streaming."""
+            # Reuse the model (and credentials) cached for this service account
+            model = _get_vertex_model(service_account_json, project_id, location, model_name)
+            
+            # Generate streaming response
+            response = model.generate_content(
+                content_parts,
+                stream=True,
+                generation_config={
+                    'temperature': 1.0,
+                    'top_p': 0.95,
+                    'max_output_tokens': 65536,
+                }
+            )
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
         
         has_yielded = False
-        for chunk in response:
-            if chunk.text:
-                has_yielded = True
-                yield chunk.text
+        for text in _stream_in_worker(_produce_texts):
+            has_yielded = True
+            yield text
         
         if not has_yielded:
-            yield "I apologize, but I couldn't generate a response. Please try again."
+            yield _NO_RESPONSE_MESSAGE
             
     except Exception as e:
-        logger.error(f"Error in Vertex AI streaming: {e}")
-        traceback.print_exc()
+        logger.exception("Error in Vertex AI streaming")
         yield _format_error_message(e)
 
 
+async def _stream_adk_response(
+    message: str,
+    prompt_message: str,
+    *,
+    user_id: str,
+    api_key: str,
+    model_name: str,
+    conversation_id: Optional[int],
+    history: Optional[List[Dict[str, Any]]],
+    username: Optional[str],
+    attachments: List[Dict[str, str]],
+    part_attachments: List[Dict[str, str]],
+    use_uri: bool,
+    vertex_settings: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    Run one turn through the multi-agent ADK system and stream its text.
+    
+    Shared by the async API and the sync wrapper, which both drive it on the
+    background loop, so both paths prepare and stream identically.
+    
+    Args:
+        message: The user's message as stored in the conversation
+        prompt_message: Message sent to the model (may carry extra context)
+        user_id: Agent cache / session namespace (Vertex uses its own)
+        api_key: AI Studio key, or a fingerprint of the Vertex settings
+        model_name: The Gemini model to use for all agents
+        conversation_id: Database conversation ID for persistent sessions
+        history: Optional conversation history
+        username: User's display name for personalization
+        attachments: All normalized attachments (described in the prompt)
+        part_attachments: Attachments to send as file parts
+        use_uri: Reference gs:// objects directly (Vertex AI) instead of bytes
+        vertex_settings: Vertex AI client settings; None for AI Studio
+        
+    Yields:
+        Text chunks as they are generated by the coordinator agent
+    """
+    # Admit the stream before any per-request work so a saturated server
+    # answers immediately instead of preparing a turn it will not run
+    if not _inflight_streams.acquire(blocking=False):
+        yield _SERVER_BUSY_MESSAGE
+        return
+    try:
+        # Use persistent session ID tied to conversation
+        session_id = _agent_manager.get_session_id(user_id, conversation_id)
+        # The session replays turns it has already answered; only send unseen history
+        if _agent_manager.session_has_history(user_id, session_id, history, message):
+            prompt_history = None
+        else:
+            prompt_history = history
+
+        # Render history/context, fetch attachments and create the session
+        # concurrently; none of them depends on the others
+        try:
+            text_blocks, (file_parts, attachment_error), _ = await asyncio.gather(
+                asyncio.to_thread(
+                    build_message_blocks,
+                    prompt_message,
+                    file_attachments=attachments,
+                    history=prompt_history,
+                    username=username,
+                    history_cache_key=session_id if conversation_id is not None else None,
+                ),
+                asyncio.to_thread(_build_attachment_parts, part_attachments, use_uri),
+                _agent_manager.ensure_session_exists_async(user_id, session_id),
+            )
+        except Exception as e:
+            logger.exception("Error preparing streaming request")
+            yield _format_error_message(e)
+            return
+    
+        if attachment_error:
+            yield attachment_error
+            return
+        content_parts = [types.Part.model_construct(text=block) for block in text_blocks]
+        content_parts.extend(file_parts)
+    
+        if not content_parts:
+            yield "Please provide a message or an image."
+            return
+    
+        try:
+            # Get the Runner for this user
+            runner = _agent_manager.get_runtime(user_id, api_key, model_name, vertex_settings).runner
+            logger.info(f"Using session: {session_id} for user: {user_id}, conversation: {conversation_id}")
+        
+            # Create the content message for ADK (parts are already well-formed)
+            user_content = types.Content.model_construct(
+                role="user",
+                parts=content_parts
+            )
+        
+            async def _event_texts() -> AsyncIterator[str]:
+                """Extract text fragments from the ADK event stream."""
+                async for event in runner.run_async(
+                    user_id=user_id,
+                    session_id=session_id,
+                    new_message=user_content
+                ):
+                    for text in _extract_event_texts(event):
+                        yield text
+        
+            # Run the agent with streaming using ADK, merging small fragments
+            pieces: List[str] = []
+            try:
+                async for text in _coalesce_chunks_async(_event_texts()):
+                    pieces.append(text)
+                    yield text
+            except Exception as primary_err:
+                # Clear cached runner/agent so stale state doesn't persist
+                _agent_manager.discard_agent(user_id, model_name)
+                logger.error(
+                    "ADK stream failed (%s): %s",
+                    type(primary_err).__name__, str(primary_err)[:300],
+                )
+                raise
+        
+            # Ensure we always yield something
+            if not pieces:
+                yield _NO_RESPONSE_MESSAGE
+                return
+        
+            _agent_manager.record_session_turn(user_id, session_id, message)
+                    
+        except Exception as e:
+            logger.exception("Error generating streaming response")
+            yield _format_error_message(e)
+    finally:
+        _inflight_streams.release()
+
+
 async def generate_streaming_response_async(
     message: str,
     image_path: Optional[str] = None,
@@ -956,100 +2104,27 @@ async def generate_streaming_response_async(
     if model_name is None:
         model_name = os.environ.get('GEMINI_MODEL', 'gemini-3-flash')
     
-    # Build content parts for the message
-    content_parts = []
-    
     normalized_attachments = _normalize_file_attachments(
         image_path=image_path,
         image_mime_type=image_mime_type,
         file_attachments=file_attachments,
     )
 
-    # Build text content with history context and username
-    text_content = build_message_content(
+    # Runtimes share loop-bound HTTP clients, so the turn runs on the shared loop
+    async for chunk in _aiterate_on_background_loop(_stream_adk_response(
         message,
-        file_attachments=normalized_attachments,
+        message or "",
+        user_id=user_id,
+        api_key=api_key,
+        model_name=model_name,
+        conversation_id=conversation_id,
         history=history,
         username=username,
-    )
-    if text_content:
-        content_parts.append(types.Part.from_text(text=text_content))
-    
-    # Handle file uploads
-    for attachment in normalized_attachments:
-        attachment_path = attachment.get('path')
-        attachment_mime = attachment.get('mime_type')
-        logger.info("Processing file: path=%s, mime_type=%s", attachment_path, attachment_mime)
-
-        # Download and validate file
-        result = _download_file_from_gcs(attachment_path)
-        if result is None:
-            yield "Error: Failed to download file from storage."
-            return
-        
-        file_data, file_size = result
-        
-        # Validate file
-        validation_error = _validate_file(attachment_mime, file_size)
-        if validation_error:
-            yield validation_error
-            return
-        
-        # Create a part from bytes for multimodal content
-        file_part = types.Part.from_bytes(data=file_data, mime_type=attachment_mime)
-        content_parts.append(file_part)
-        logger.info("File part added to contents")
-    
-    if not content_parts:
-        yield "Please provide a message or an image."
-        return
-    
-    try:
-        # Set the API key in environment for ADK
-        os.environ['GOOGLE_API_KEY'] = api_key
-        
-        # Get the Runner for this user
-        runner = _agent_manager.get_or_create_runner(user_id, api_key, model_name)
-        
-        # Use persistent session ID tied to conversation
-        session_id = _agent_manager.get_session_id(user_id, conversation_id)
-        
-        # Ensure the session exists before using it
-        await _agent_manager.ensure_session_exists_async(user_id, session_id)
-        logger.info(f"Using session: {session_id} for user: {user_id}, conversation: {conversation_id}")
-        
-        # Create the content message for ADK
-        user_content = types.Content(
-            role="user",
-            parts=content_parts
-        )
-        
-        # Run the agent with streaming using ADK
-        has_yielded = False
-        async for event in runner.run_async(
-            user_id=user_id,
-            session_id=session_id,
-            new_message=user_content
-        ):
-            # Handle different event types from ADK
-            if hasattr(event, 'content') and event.content:
-                if hasattr(event.content, 'parts') and event.content.parts:
-                    for part in event.content.parts:
-                        if hasattr(part, 'text') and part.text:
-                            has_yielded = True
-                            yield part.text
-            elif hasattr(event, 'text') and getattr(event, 'text', None):
-                has_yielded = True
-                yield getattr(event, 'text')
-        
-        # Ensure we always yield something
-        if not has_yielded:
-            yield "I apologize, but I couldn't generate a response. Please try again."
-                    
-    except Exception as e:
-        logger.error(f"Error generating streaming response: {e}")
-        traceback.print_exc()
-        yield _format_error_message(e)
+        attachments=normalized_attachments,
+        part_attachments=normalized_attachments,
+        use_uri=False,
+    )):
+        yield chunk
 
 
 def generate_streaming_response(
@@ -1093,12 +2168,12 @@ def generate_streaming_response(
     Yields:
         Text chunks as they are generated
     """
-    _saved_vertex_env: Dict[str, Optional[str]] = {}
+    vertex_settings: Optional[Dict[str, Any]] = None
 
     # Route to the appropriate provider
     if provider == 'vertex_ai' and vertex_config:
-        # Configure ADK to use Vertex AI as backend via environment variables.
-        # Supports both service-account auth and Vertex express-mode API key auth.
+        # Run the same ADK multi-agent system against Vertex AI. Supports both
+        # service-account auth and Vertex express-mode API key auth.
         auth_mode = (vertex_config.get('auth_mode') or '').strip().lower()
         service_account_json = vertex_config.get('service_account')
         vertex_api_key = vertex_config.get('api_key')
@@ -1115,71 +2190,30 @@ def generate_streaming_response(
             yield "Error: Vertex AI API key is required for API key mode."
             return
 
-        _sa_tmp = None
         try:
-            # Snapshot current env and restore in finally to avoid cross-request pollution.
-            for _var in (
-                'GOOGLE_GENAI_USE_VERTEXAI',
-                'GOOGLE_CLOUD_PROJECT',
-                'GOOGLE_CLOUD_LOCATION',
-                'GOOGLE_APPLICATION_CREDENTIALS',
-                'GOOGLE_GENAI_API_KEY',
-                'GOOGLE_API_KEY',
-                'GEMINI_API_KEY',
-            ):
-                _saved_vertex_env[_var] = os.environ.get(_var)
-
-            os.environ['GOOGLE_GENAI_USE_VERTEXAI'] = 'true'
-
             if auth_mode == 'service_account':
-                os.environ['GOOGLE_CLOUD_PROJECT'] = project_id
-                os.environ['GOOGLE_CLOUD_LOCATION'] = location
-                os.environ.pop('GOOGLE_GENAI_API_KEY', None)
-                os.environ.pop('GOOGLE_API_KEY', None)
-                os.environ.pop('GEMINI_API_KEY', None)
-
-                # Local / custom SA path: keep existing temp-file behavior.
-                # Cloud Run ADC path: service_account_json can be None.
-                if service_account_json:
-                    _sa_tmp = tempfile.NamedTemporaryFile(
-                        mode='w', suffix='.json', prefix='vertex_sa_', delete=False
-                    )
-                    _sa_tmp.write(service_account_json if isinstance(service_account_json, str)
-                                  else json.dumps(service_account_json))
-                    _sa_tmp.flush()
-                    _sa_tmp.close()
-                    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = _sa_tmp.name
-                else:
-                    os.environ.pop('GOOGLE_APPLICATION_CREDENTIALS', None)
+                # Cloud Run ADC path: service_account_json can be None
+                vertex_settings = {
+                    'project': project_id,
+                    'location': location,
+                    'credentials_key': _vertex_credentials_key(service_account_json),
+                }
             else:
-                # Vertex express-mode auth via API key. For the ADK/google-genai
-                # stack in this code path, GOOGLE_API_KEY is the credential env var.
-                os.environ['GOOGLE_API_KEY'] = vertex_api_key
-                os.environ.pop('GOOGLE_GENAI_API_KEY', None)
-                os.environ.pop('GEMINI_API_KEY', None)
-                os.environ.pop('GOOGLE_CLOUD_PROJECT', None)
-                os.environ.pop('GOOGLE_CLOUD_LOCATION', None)
-                os.environ.pop('GOOGLE_APPLICATION_CREDENTIALS', None)
-
-            logger.info("Vertex AI ADK mode: auth_mode=%s project=%s location=%s model=%s",
-                        auth_mode, project_id, location, model_name)
+                # Express mode authenticates with the key alone (no project/location)
+                vertex_settings = {'api_key': vertex_api_key}
         except Exception as exc:
-            logger.error("Failed to configure Vertex AI env: %s", exc)
+            logger.error("Failed to configure Vertex AI: %s", exc)
             yield f"Error configuring Vertex AI: {exc}"
             return
 
+        logger.info("Vertex AI ADK mode: auth_mode=%s project=%s location=%s model=%s",
+                    auth_mode, project_id, location, model_name)
+
         # Use a distinct agent_key suffix so Vertex agents aren't mixed with
         # AI Studio agents in the cache.
         vertex_user_id = f"{user_id}_vertex"
-        try:
-            # Ensure a dummy api_key is passed (not used for Vertex, but avoids
-            # validation errors in our wrapper code).
-            _dummy_api_key = "vertex-ai-backend"
-        except Exception:
-            pass
     else:
         vertex_user_id = None
-        _sa_tmp = None
 
     # AI Studio / ADK path (also used by Vertex AI now)
     # Validate and set defaults
@@ -1193,8 +2227,10 @@ def generate_streaming_response(
             yield "Error: API key is required but not provided. Please set your API key in the settings."
             return
     else:
-        # Vertex AI — api_key not needed; use placeholder for internal cache logic
-        api_key = api_key or "vertex-ai-backend"
+        # Cached Vertex runtimes are rebuilt when any client setting changes
+        api_key = "vertex:" + hashlib.blake2b(
+            json.dumps(vertex_settings, sort_keys=True).encode(), digest_size=16
+        ).hexdigest()
     
     if model_name is None:
         model_name = os.environ.get('GEMINI_MODEL', 'gemini-3-flash')
@@ -1239,192 +2275,22 @@ def generate_streaming_response(
                 f"{transcript_text}"
             )
     
-    # Build content parts for the message
-    content_parts = []
-    
-    # Build text content with history context and username
-    text_content = build_message_content(
+    # Drive the shared ADK pipeline on the background loop; Vertex gets its own
+    # agent cache and session namespace
+    yield from _iterate_on_background_loop(_stream_adk_response(
+        message,
         augmented_message,
-        file_attachments=normalized_attachments,
+        user_id=vertex_user_id if _is_vertex else user_id,
+        api_key=api_key,
+        model_name=model_name,
+        conversation_id=conversation_id,
         history=history,
         username=username,
-    )
-    if text_content:
-        content_parts.append(types.Part.from_text(text=text_content))
-    elif augmented_message:
-        content_parts.append(types.Part.from_text(text=augmented_message))
-    
-    # Handle file uploads
-    for attachment in attachments_for_parts:
-        attachment_path = attachment.get('path')
-        attachment_mime = attachment.get('mime_type')
-        logger.info("Processing file: path=%s, mime_type=%s", attachment_path, attachment_mime)
-
-        # Download and validate file
-        result = _download_file_from_gcs(attachment_path)
-        if result is None:
-            yield "Error: Failed to download file from storage."
-            return
-        
-        file_data, file_size = result
-        
-        # Validate file
-        validation_error = _validate_file(attachment_mime, file_size)
-        if validation_error:
-            yield validation_error
-            return
-        
-        file_part = types.Part.from_bytes(data=file_data, mime_type=attachment_mime)
-        content_parts.append(file_part)
-        logger.info("File part added to contents")
-    
-    if not content_parts:
-        yield "Please provide a message or an image."
-        return
-    
-    try:
-        # Set the API key in environment for ADK (AI Studio only)
-        if not _is_vertex:
-            os.environ['GOOGLE_API_KEY'] = api_key
-        
-        # Get the Runner for this user (Vertex gets its own cache namespace)
-        effective_uid = vertex_user_id if _is_vertex else user_id
-        runner = _agent_manager.get_or_create_runner(effective_uid, api_key, model_name)
-        
-        # Use persistent session ID tied to conversation
-        session_id = _agent_manager.get_session_id(effective_uid, conversation_id)
-        
-        # Ensure the session exists before using it (sync version)
-        _agent_manager.ensure_session_exists(effective_uid, session_id)
-        logger.info(f"Using session: {session_id} for user: {effective_uid}, conversation: {conversation_id}")
-        
-        # Create the content message for ADK
-        user_content = types.Content(
-            role="user",
-            parts=content_parts
-        )
-        
-        # For synchronous usage with streaming, we need to use a thread-safe approach
-        # that yields chunks as they arrive rather than collecting them all first
-        import queue
-        import threading
-        
-        # Create a queue to pass chunks from async to sync context
-        chunk_queue = queue.Queue()
-        exception_holder = [None]  # Use list to allow modification in nested function
-        
-        def run_in_thread():
-            """Run the async generator in a separate thread with its own event loop."""
-            try:
-                async def stream_chunks():
-                    """Async function to stream chunks into the queue."""
-
-                    async def _try_stream(target_runner, uid, sid, content):
-                        """Attempt streaming once. Raises on failure."""
-                        has_content = False
-                        async for event in target_runner.run_async(
-                            user_id=uid,
-                            session_id=sid,
-                            new_message=content
-                        ):
-                            if hasattr(event, 'content') and event.content:
-                                if hasattr(event.content, 'parts') and event.content.parts:
-                                    for part in event.content.parts:
-                                        if hasattr(part, 'text') and part.text:
-                                            chunk_queue.put(part.text)
-                                            has_content = True
-                            elif hasattr(event, 'text') and getattr(event, 'text', None):
-                                chunk_queue.put(getattr(event, 'text'))
-                                has_content = True
-                        if not has_content:
-                            chunk_queue.put("I apologize, but I couldn't generate a response. Please try again.")
-
-                    try:
-                        await _try_stream(runner, effective_uid, session_id, user_content)
-                    except Exception as primary_err:
-                        primary_str = str(primary_err)
-                        # Clear cached runner/agent so stale state doesn't persist
-                        runner_key = f"{effective_uid}_{model_name}"
-                        _agent_manager._runners.pop(runner_key, None)
-                        _agent_manager._agents.pop(runner_key, None)
-                        logger.error(
-                            "ADK stream failed (%s): %s",
-                            type(primary_err).__name__, primary_str[:300],
-                        )
-                        exception_holder[0] = primary_err
-                    finally:
-                        chunk_queue.put(None)
-
-                # Let asyncio handle loop lifecycle and pending-task cleanup.
-                asyncio.run(stream_chunks())
-                
-            except Exception as e:
-                exception_holder[0] = e
-                chunk_queue.put(None)
-        
-        # Start the async processing in a separate thread
-        thread = threading.Thread(target=run_in_thread, daemon=True)
-        thread.start()
-        
-        # Yield chunks as they arrive from the queue.
-        # Use non-blocking reads so eventlet's green-thread hub can schedule
-        # other requests (sidebar, rename, delete, etc.) concurrently.
-        while True:
-            try:
-                chunk = chunk_queue.get(timeout=0.05)
-            except queue.Empty:
-                # Yield control to the eventlet hub so other requests can proceed
-                try:
-                    import eventlet
-                    eventlet.sleep(0)
-                except ImportError:
-                    pass
-                continue
-            
-            # Check if we're done (None signals completion)
-            if chunk is None:
-                break
-            
-            # Check for exceptions
-            if exception_holder[0]:
-                raise exception_holder[0]
-            
-            yield chunk
-        
-        # Wait for thread to complete
-        thread.join(timeout=1.0)
-        
-        # Check for any exceptions that occurred
-        if exception_holder[0]:
-            raise exception_holder[0]
-                
-    except Exception as e:
-        logger.error(f"Error generating streaming response: {e}")
-        traceback.print_exc()
-        yield _format_error_message(e)
-    finally:
-        # --- Vertex AI env-var cleanup ---
-        if _is_vertex:
-            for _var in (
-                'GOOGLE_GENAI_USE_VERTEXAI',
-                'GOOGLE_CLOUD_PROJECT',
-                'GOOGLE_CLOUD_LOCATION',
-                'GOOGLE_APPLICATION_CREDENTIALS',
-                'GOOGLE_GENAI_API_KEY',
-                'GOOGLE_API_KEY',
-                'GEMINI_API_KEY',
-            ):
-                _original_value = _saved_vertex_env.get(_var)
-                if _original_value is None:
-                    os.environ.pop(_var, None)
-                else:
-                    os.environ[_var] = _original_value
-            # Delete temporary service-account file
-            if _sa_tmp is not None:
-                try:
-                    os.unlink(_sa_tmp.name)
-                except OSError:
-                    pass
+        attachments=normalized_attachments,
+        part_attachments=attachments_for_parts,
+        use_uri=_is_vertex,
+        vertex_settings=vertex_settings,
+    ))
 
 
 # Export the agent manager for external access if needed
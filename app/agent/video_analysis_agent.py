@@ -15,7 +15,6 @@ import os
 import json
 import logging
 import time
-import traceback
 import threading
 import asyncio
 from datetime import datetime
@@ -701,8 +700,7 @@ def run_video_analysis(
                 time.sleep(wait_time)
                 continue
 
-            logger.error("Video analysis failed: %s", e)
-            traceback.print_exc()
+            logger.exception("Video analysis failed: %s", e)
             return {"success": False, "error": str(e)}
 
     return {"success": False, "error": f"All {max_retries} attempts failed: {last_error}"}
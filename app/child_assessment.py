@@ -25,11 +25,29 @@ def hk_now() -> datetime:
     return datetime.now(_HK_TZ).replace(tzinfo=None)
 import re
 
+from functools import lru_cache
+from itertools import islice
+
 try:
-    import PyPDF2
-    HAS_PYPDF = True
+    import fitz  # PyMuPDF
+    HAS_PYMUPDF = True
 except ImportError:
-    HAS_PYPDF = False
+    HAS_PYMUPDF = False
+
+
+@lru_cache(maxsize=8)
+def _read_pdf_head(pdf_path: str, mtime: float, size: int) -> Tuple[int, str]:
+    """Return (page_count, text of the first 3 pages) for a PDF.
+
+    Keyed on mtime and size as well as the path so a replaced file is
+    re-parsed; the same uploaded PDF is otherwise parsed only once.
+    """
+    with fitz.open(pdf_path) as doc:
+        # Pages are loaded lazily
+        text = ''.join(
+            page.get_text("text") or '' for page in doc.pages(0, min(3, doc.page_count))
+        )
+        return doc.page_count, text
 
 
 class ChildDevelopmentAssessmentWST580:
@@ -47,6 +65,16 @@ class ChildDevelopmentAssessmentWST580:
         'social_behavior': {'name': '社會情感', 'code': 'SEB', 'emoji': '👥'}
     }
     
+    # PDF context keywords: development-related, then health-related
+    CONTEXT_KEYWORDS = (
+        '發育', '發展', '運動', '語言', '認知', '社交', '適應',
+        '動作', '行為', '發育遲緩', '早期干預', '評估', '診斷',
+        '健康', '病史', '過敏', '疾病', '藥物', '手術', '預防針',
+        '營養', '睡眠', '飲食', '感染', '發燒'
+    )
+    DEVELOPMENT_CHECK_KEYWORDS = ('發育', '發展', '運動', '語言', '認知', '發育遲緩', '評估')
+    HEALTH_CHECK_KEYWORDS = ('健康', '病史', '過敏', '疾病', '預防針', '營養')
+    
     # Age groups in months: 28 age groups from 1-84 months
     AGE_GROUPS = [
         1, 2, 3, 4, 5, 6, 8, 10, 12,  # 0-12 months (9 groups)
@@ -142,7 +170,7 @@ class ChildDevelopmentAssessmentWST580:
         
         # Extract context from PDF if available
         pdf_context = {}
-        if self.pdf_path and os.path.exists(self.pdf_path):
+        if self.pdf_path:
             pdf_context = self._extract_pdf_context()
         
         # Create questions for each domain
@@ -188,7 +216,12 @@ class ChildDevelopmentAssessmentWST580:
         Returns:
             Dictionary containing extracted PDF information
         """
-        if not HAS_PYPDF or not self.pdf_path or not os.path.exists(self.pdf_path):
+        if not HAS_PYMUPDF or not self.pdf_path:
+            return {}
+        
+        try:
+            stat = os.stat(self.pdf_path)
+        except OSError:
             return {}
         
         try:
@@ -200,14 +233,9 @@ class ChildDevelopmentAssessmentWST580:
                 'keywords': []
             }
             
-            with open(self.pdf_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                context['pages'] = len(pdf_reader.pages)
-                
-                # Extract text from first few pages
-                for page_num in range(min(3, len(pdf_reader.pages))):
-                    page = pdf_reader.pages[page_num]
-                    context['text'] += page.extract_text() or ''
+            context['pages'], context['text'] = _read_pdf_head(
+                self.pdf_path, stat.st_mtime, stat.st_size
+            )
             
             # Analyze extracted text
             context['keywords'] = self._extract_keywords(context['text'])
@@ -222,39 +250,18 @@ class ChildDevelopmentAssessmentWST580:
     
     def _extract_keywords(self, text: str) -> List[str]:
         """Extract relevant keywords from text"""
-        keywords = []
-        
-        # Development-related keywords
-        development_keywords = [
-            '發育', '發展', '運動', '語言', '認知', '社交', '適應',
-            '動作', '行為', '發育遲緩', '早期干預', '評估', '診斷'
-        ]
-        
-        # Health-related keywords
-        health_keywords = [
-            '健康', '病史', '過敏', '疾病', '藥物', '手術', '預防針',
-            '營養', '睡眠', '飲食', '感染', '發燒'
-        ]
-        
-        text_lower = text.lower()
-        
-        for keyword in development_keywords + health_keywords:
-            if keyword in text_lower:
-                keywords.append(keyword)
-        
-        return list(set(keywords[:10]))  # Return top 10 unique keywords
+        # Keywords are CJK, so matching needs no case folding; stop scanning
+        # once 10 have been found.
+        keywords = list(islice((k for k in self.CONTEXT_KEYWORDS if k in text), 10))
+        return list(set(keywords))  # Return top 10 unique keywords
     
     def _check_development_keywords(self, text: str) -> bool:
         """Check if text contains development-related information"""
-        dev_keywords = ['發育', '發展', '運動', '語言', '認知', '發育遲緩', '評估']
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in dev_keywords)
+        return any(keyword in text for keyword in self.DEVELOPMENT_CHECK_KEYWORDS)
     
     def _check_health_keywords(self, text: str) -> bool:
         """Check if text contains health-related information"""
-        health_keywords = ['健康', '病史', '過敏', '疾病', '預防針', '營養']
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in health_keywords)
+        return any(keyword in text for keyword in self.HEALTH_CHECK_KEYWORDS)
     
     def _generate_personalized_description(self, domain: str, item_num: int, 
                                            age_group: int, pdf_context: Dict) -> str:
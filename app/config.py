@@ -33,6 +33,47 @@ def apply_runtime_google_credentials(config_obj=None) -> None:
     if credentials_path:
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
 
+def normalize_database_uri(uri):
+    """Route plain Postgres URLs through the psycopg (v3) SQLAlchemy driver."""
+    for prefix in ('postgres://', 'postgresql://', 'postgresql+psycopg2://'):
+        if uri.startswith(prefix):
+            return 'postgresql+psycopg://' + uri[len(prefix):]
+    return uri
+
+
+def _engine_options(uri):
+    """Connection pool settings; Postgres also gets server-side prepared statements."""
+    from . import fast_json
+
+    # JSON columns (message metadata, reports, ...) go through orjson
+    json_options = {
+        'json_serializer': fast_json.dumps,
+        'json_deserializer': fast_json.loads,
+    }
+    if not uri.startswith('postgresql'):
+        return json_options
+    if os.environ.get('DB_USE_PGBOUNCER', 'false').lower() == 'true':
+        # PgBouncer in transaction mode owns pooling and multiplexes server
+        # backends, so keep no local pool and never prepare statements.
+        from sqlalchemy.pool import NullPool
+        return {
+            **json_options,
+            'poolclass': NullPool,
+            'connect_args': {'prepare_threshold': None},
+        }
+    return {
+        **json_options,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '30')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '60')),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true',
+        # Recycle instead of pinging so idle connections dropped by the
+        # database proxy are replaced without a round trip per checkout.
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE_SECONDS', '1800')),
+        'connect_args': {
+            'prepare_threshold': int(os.environ.get('DB_PREPARE_THRESHOLD', '5')),
+        },
+    }
+
 class Config:
     """Set Flask configuration variables from .env file."""
 
@@ -49,6 +90,12 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'upload')
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500 MB
 
+    # Static file offload to a fronting web server. USE_X_SENDFILE is Flask's
+    # own switch (Apache/lighttpd); VIDEOS_X_ACCEL_PREFIX names an nginx
+    # `internal` location aliased to app/videos_quesyions.
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+    VIDEOS_X_ACCEL_PREFIX = os.environ.get('VIDEOS_X_ACCEL_PREFIX', '')
+
     # Allowed file extensions
     ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm', 'flv', 'wmv'}
@@ -67,14 +114,21 @@ class Config:
     SOCKETIO_PING_INTERVAL = int(os.environ.get('SOCKETIO_PING_INTERVAL', '25'))
     SOCKETIO_IDLE_TIMEOUT_SECONDS = int(os.environ.get('SOCKETIO_IDLE_TIMEOUT_SECONDS', '3600'))
     SOCKETIO_MAX_RECONNECT_ATTEMPTS = int(os.environ.get('SOCKETIO_MAX_RECONNECT_ATTEMPTS', '3'))
+    # Compress Engine.IO payloads at or above the threshold (bytes)
+    SOCKETIO_HTTP_COMPRESSION = os.environ.get('SOCKETIO_HTTP_COMPRESSION', 'true').lower() == 'true'
+    SOCKETIO_COMPRESSION_THRESHOLD = int(os.environ.get('SOCKETIO_COMPRESSION_THRESHOLD', '256'))
 
     # Database
     # Use DATABASE_URL environment variable if provided (Postgres, MySQL, etc.),
     # otherwise fall back to a local SQLite file at project root.
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    SQLALCHEMY_DATABASE_URI = normalize_database_uri(os.environ.get('DATABASE_URL', 'sqlite:///app.db'))
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    # When True, create DB tables automatically on app startup (useful for dev)
-    CREATE_DB_ON_STARTUP = os.environ.get('CREATE_DB_ON_STARTUP', 'true').lower() == 'true'
+    # When True, create DB tables automatically on app startup (useful for dev).
+    # Defaults to on only in development; production schemas come from migrations.
+    CREATE_DB_ON_STARTUP = os.environ.get(
+        'CREATE_DB_ON_STARTUP', 'true' if FLASK_ENV == 'development' else 'false'
+    ).lower() == 'true'
 
     # JWT Configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt_default_secret_key')
@@ -106,6 +160,7 @@ class Config:
     RAG_ZEROX_TIMEOUT_SECONDS = int(os.environ.get('RAG_ZEROX_TIMEOUT_SECONDS', '300'))
     RAG_ZEROX_TIMEOUT_RETRY = os.environ.get('RAG_ZEROX_TIMEOUT_RETRY', 'false').lower() == 'true'
     RAG_ZEROX_PAGE_BATCH_SIZE = int(os.environ.get('RAG_ZEROX_PAGE_BATCH_SIZE', '15'))
+    RAG_ZEROX_PARALLEL_BATCHES = int(os.environ.get('RAG_ZEROX_PARALLEL_BATCHES', '2'))
     RAG_CHUNK_SIZE = int(os.environ.get('RAG_CHUNK_SIZE', '800'))
     RAG_CHUNK_OVERLAP = int(os.environ.get('RAG_CHUNK_OVERLAP', '100'))
     RAG_BATCH_MAX_FILES = int(os.environ.get('RAG_BATCH_MAX_FILES', '10'))
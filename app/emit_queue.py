@@ -0,0 +1,77 @@
+"""
+Cross-thread Socket.IO emit queue.
+
+Background workers (RAG processing threads, ADK agent tools) enqueue events
+with a plain ``deque.append`` and a single drain task owned by Socket.IO
+issues the actual emits, so producer threads never contend with each other
+on the server's send path and per-room ordering is preserved.
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_DRAIN_BATCH_SIZE = 128
+_GREEN_MODES = {'eventlet', 'gevent', 'gevent_uwsgi'}
+
+_pending: deque = deque()
+_wakeup = threading.Event()
+_drainer_lock = threading.Lock()
+_drainer_started = False
+
+
+def put(event: str, payload: Any, room: Optional[str] = None, namespace: str = '/') -> None:
+    """Queue a Socket.IO event for emission from the drain task."""
+    _pending.append((event, payload, room, namespace))
+    _wakeup.set()
+    if not _drainer_started:
+        _start_drainer()
+
+
+def _start_drainer() -> None:
+    """Start the single drain task on first use."""
+    global _drainer_started
+
+    with _drainer_lock:
+        if _drainer_started:
+            return
+        from app import socketio
+        socketio.start_background_task(_drain_loop)
+        _drainer_started = True
+
+
+def _wait_for_items(socketio) -> None:
+    """Block until a producer signals new items."""
+    if getattr(socketio, 'async_mode', None) in _GREEN_MODES:
+        # A native Event.wait() would block the whole hub; poll cooperatively.
+        while not _pending:
+            socketio.sleep(0.01)
+        return
+    _wakeup.wait()
+
+
+def _drain_loop() -> None:
+    """Pop queued events in batches and emit them in FIFO order."""
+    from app import socketio
+
+    while True:
+        # Clear before checking so a put() racing with this check is not lost.
+        _wakeup.clear()
+        if not _pending:
+            _wait_for_items(socketio)
+
+        for _ in range(_DRAIN_BATCH_SIZE):
+            try:
+                event, payload, room, namespace = _pending.popleft()
+            except IndexError:
+                break
+            try:
+                socketio.emit(event, payload, room=room, namespace=namespace)
+            except Exception as exc:
+                logger.debug("Could not emit queued %s event: %s", event, exc)
+
+        # Let other green threads run between batches.
+        socketio.sleep(0)
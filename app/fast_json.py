@@ -0,0 +1,80 @@
+"""
+orjson-backed JSON encoding for Flask responses, Socket.IO packets and
+database JSON columns.
+
+Falls back to the stdlib encoders when orjson is not installed, so the app
+behaves the same either way (only faster with orjson).
+"""
+
+import json
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+_COMPACT_SEPARATORS = (',', ':')
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when available.
+
+    Datetimes are passed through to Flask's default handler so response
+    formats stay identical to the stdlib provider.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('separators', _COMPACT_SEPARATORS) == _COMPACT_SEPARATORS:
+            kwargs.pop('separators', None)
+        if kwargs.get('indent') == 2:
+            kwargs.pop('indent')
+            option |= orjson.OPT_INDENT_2
+        if kwargs:
+            # Unsupported stdlib options (cls, custom indent, ...) keep the slow path
+            return super().dumps(obj, **kwargs)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def dumps(obj: Any) -> str:
+    """Compact JSON encode; also used as SQLAlchemy's JSON column serializer."""
+    if orjson is None:
+        return json.dumps(obj)
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def loads(s: str | bytes) -> Any:
+    """JSON decode; also used as SQLAlchemy's JSON column deserializer."""
+    if orjson is None:
+        return json.loads(s)
+    return orjson.loads(s)
+
+
+class SocketIOJSON:
+    """json-module shim handed to python-socketio for packet encoding."""
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs: Any) -> str:
+        if orjson is None:
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    @staticmethod
+    def loads(s: str | bytes, **kwargs: Any) -> Any:
+        if orjson is None:
+            return json.loads(s, **kwargs)
+        return loads(s)
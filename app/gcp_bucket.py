@@ -12,13 +12,22 @@ def hk_now() -> datetime:
 from werkzeug.utils import secure_filename
 import uuid
 import logging
+import threading
 
 
 logger = logging.getLogger(__name__)
 
+# One storage client per worker thread: building a client reloads credentials
+# and opens a fresh HTTPS session, which dominated small uploads.
+_client_local = threading.local()
+
 def get_gcs_client():
-    apply_runtime_google_credentials()
-    return storage.Client()
+    client = getattr(_client_local, 'client', None)
+    if client is None:
+        apply_runtime_google_credentials()
+        client = storage.Client()
+        _client_local.client = client
+    return client
 
 def build_storage_key(category, user_id, original_filename):
     """Build standardized GCS object key: {user_id}/{category}/{original_filename}_{timestamp}.{ext}"""
@@ -91,6 +100,71 @@ def download_file_from_gcs(gcs_url):
     # Download to bytes
     return blob.download_as_bytes()
 
+def open_file_from_gcs(gcs_url, spool_size=1024 * 1024):
+    """
+    Download a GCS object into an anonymous temporary file for streaming.
+
+    Objects larger than ``spool_size`` are written to disk so they can be
+    served with the WSGI file wrapper (``sendfile(2)`` under gunicorn)
+    instead of being held and copied as one in-memory bytes object.
+
+    Args:
+        gcs_url: Full GCS URL (gs://bucket/filename) or HTTPS URL
+        spool_size: Size in bytes kept in memory before spilling to disk
+
+    Returns:
+        file-like object positioned at the start; the caller must close it
+    """
+    client = get_gcs_client()
+
+    if gcs_url.startswith('https://storage.googleapis.com/'):
+        parts = gcs_url.replace('https://storage.googleapis.com/', '').split('/')
+    elif gcs_url.startswith('gs://'):
+        parts = gcs_url.replace('gs://', '').split('/')
+    else:
+        raise ValueError("Invalid GCS URL format")
+
+    blob = client.bucket(parts[0]).blob('/'.join(parts[1:]))
+
+    temp_file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        blob.download_to_file(temp_file)
+        temp_file.seek(0)
+    except Exception:
+        temp_file.close()
+        raise
+    return temp_file
+
+def get_gcs_object_info(gcs_url):
+    """
+    Resolve a stored file to its gs:// URI, size, generation and content type without downloading it.
+
+    Only the object metadata is fetched, so Vertex AI can read the bytes
+    straight from the bucket (``Part.from_uri``). The generation changes
+    whenever the object is rewritten, which makes it a safe cache key.
+
+    Args:
+        gcs_url: Full GCS URL (gs://bucket/filename) or HTTPS URL
+
+    Returns:
+        tuple: (gs:// URI, size in bytes, generation, content type or None)
+    """
+    client = get_gcs_client()
+
+    if gcs_url.startswith('https://storage.googleapis.com/'):
+        parts = gcs_url.replace('https://storage.googleapis.com/', '').split('/')
+    elif gcs_url.startswith('gs://'):
+        parts = gcs_url.replace('gs://', '').split('/')
+    else:
+        raise ValueError("Invalid GCS URL format")
+
+    bucket_name = parts[0]
+    blob_name = '/'.join(parts[1:])
+    blob = client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise NotFound(f"File not found: {gcs_url}")
+    return f"gs://{bucket_name}/{blob_name}", blob.size, blob.generation, blob.content_type
+
 def get_file_from_gcs(gcs_url):
     """
     Get a file-like object from GCS for reading.
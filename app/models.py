@@ -9,12 +9,30 @@ def hk_now() -> datetime:
     """Return current datetime in Hong Kong Time (UTC+8), stored as timezone-naive."""
     return datetime.now(HK_TZ).replace(tzinfo=None)
 from pgvector.sqlalchemy import Vector
+from functools import lru_cache
 import uuid
 import json
 import os
 
 db = SQLAlchemy()
 
+
+_encryption_key = None
+
+
+def _get_encryption_key():
+    """Return ENCRYPTION_KEY, caching it once set (None is re-checked on each call)."""
+    global _encryption_key
+    if _encryption_key is None:
+        _encryption_key = os.environ.get('ENCRYPTION_KEY')
+    return _encryption_key
+
+@lru_cache(maxsize=4)
+def _get_cipher(encryption_key: str):
+    """Return a Fernet cipher for the key, reused across rows and calls."""
+    from cryptography.fernet import Fernet
+    return Fernet(encryption_key.encode())
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -148,36 +166,30 @@ class UserApiKey(db.Model):
     
     def set_encrypted_key(self, plain_key):
         """Encrypt and store the API key"""
-        from cryptography.fernet import Fernet
         import base64
-        import os
         
         # Use a fixed key for encryption (in production, use environment variable)
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
+        encryption_key = _get_encryption_key()
         if not encryption_key:
             # Generate a key if not set (for development)
             encryption_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
             # In production, this should be set in environment
         
-        cipher = Fernet(encryption_key.encode())
+        cipher = _get_cipher(encryption_key)
         self.encrypted_key = cipher.encrypt(plain_key.encode()).decode()
     
     def get_decrypted_key(self):
         """Decrypt and return the API key"""
         if not self.encrypted_key:
             return None
-            
-        from cryptography.fernet import Fernet
-        import base64
-        import os
         
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
+        encryption_key = _get_encryption_key()
         if not encryption_key:
             # For development, try to decrypt with generated key (won't work)
             return None
         
         try:
-            cipher = Fernet(encryption_key.encode())
+            cipher = _get_cipher(encryption_key)
             return cipher.decrypt(self.encrypted_key.encode()).decode()
         except Exception:
             return None
@@ -226,8 +238,6 @@ class VertexServiceAccount(db.Model):
         Raises:
             ValueError: If encryption key is missing or JSON is invalid
         """
-        from cryptography.fernet import Fernet
-        
         # Validate JSON structure
         try:
             creds_dict = json.loads(service_account_json)
@@ -246,11 +256,11 @@ class VertexServiceAccount(db.Model):
         self.client_email = creds_dict['client_email']
         
         # Encrypt the full JSON
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
+        encryption_key = _get_encryption_key()
         if not encryption_key:
             raise ValueError('ENCRYPTION_KEY environment variable is required')
         
-        cipher = Fernet(encryption_key.encode())
+        cipher = _get_cipher(encryption_key)
         self.encrypted_credentials = cipher.encrypt(service_account_json.encode()).decode()
     
     def get_decrypted_credentials(self):
@@ -263,14 +273,12 @@ class VertexServiceAccount(db.Model):
         if not self.encrypted_credentials:
             return None
         
-        from cryptography.fernet import Fernet
-        
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
+        encryption_key = _get_encryption_key()
         if not encryption_key:
             return None
         
         try:
-            cipher = Fernet(encryption_key.encode())
+            cipher = _get_cipher(encryption_key)
             return cipher.decrypt(self.encrypted_credentials.encode()).decode()
         except Exception:
             return None
@@ -790,6 +798,15 @@ class RagChunk(db.Model):
     A single semantic chunk of text from a RagDocument, with its embedding vector.
     """
     __tablename__ = 'rag_chunks'
+    __table_args__ = (
+        db.Index(
+            'ix_rag_chunks_embedding_hnsw',
+            'embedding',
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embedding': 'vector_cosine_ops'},
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     document_id = db.Column(db.Integer, db.ForeignKey('rag_documents.id', ondelete='CASCADE'), nullable=False, index=True)
@@ -129,6 +129,15 @@ def _get_zerox_page_batch_size() -> int:
         return max(1, int(os.environ.get("RAG_ZEROX_PAGE_BATCH_SIZE", "10")))
 
 
+def _get_zerox_parallel_batches() -> int:
+    """Return how many ZeroX page batches of one document may run at once."""
+    try:
+        from flask import current_app
+        return max(1, int(current_app.config.get("RAG_ZEROX_PARALLEL_BATCHES", 2)))
+    except RuntimeError:
+        return max(1, int(os.environ.get("RAG_ZEROX_PARALLEL_BATCHES", "2")))
+
+
 def reset_docling_converter():
     """Backward-compat no-op kept to avoid breaking imports."""
     logger.info("Docling has been removed; reset_docling_converter is now a no-op")
@@ -285,30 +294,46 @@ def _pdf_to_markdown(file_bytes: bytes) -> str:
         def _run_zerox_attempt(timeout_s: int, concurrency: int) -> str:
             # Use page-batch conversion for multi-page PDFs to avoid whole-file timeout.
             if page_count > page_batch_size:
-                parts: list[str] = []
-                total_batches = (page_count + page_batch_size - 1) // page_batch_size
-                for batch_idx, start in enumerate(range(1, page_count + 1, page_batch_size), start=1):
-                    end = min(start + page_batch_size - 1, page_count)
-                    pages = list(range(start, end + 1))
-                    logger.info(
-                        "ZeroX batch %d/%d: pages %d-%d (timeout=%ss, concurrency=%s)",
-                        batch_idx,
-                        total_batches,
-                        start,
-                        end,
-                        timeout_s,
-                        concurrency,
-                    )
-                    part = _run_async_sync(
-                        _zerox_convert_pdf(
-                            tmp_path,
-                            timeout_s=timeout_s,
-                            concurrency=concurrency,
-                            select_pages=pages,
-                        )
-                    )
-                    if part and part.strip():
-                        parts.append(part.strip())
+                batches = [
+                    list(range(start, min(start + page_batch_size - 1, page_count) + 1))
+                    for start in range(1, page_count + 1, page_batch_size)
+                ]
+                total_batches = len(batches)
+                parallel_batches = _get_zerox_parallel_batches()
+
+                async def _convert_batches() -> list[str]:
+                    # Batches are independent page ranges; run a few at once
+                    # and keep results in page order.
+                    semaphore = asyncio.Semaphore(parallel_batches)
+
+                    async def _convert_batch(batch_idx: int, pages: list[int]) -> str:
+                        async with semaphore:
+                            logger.info(
+                                "ZeroX batch %d/%d: pages %d-%d (timeout=%ss, concurrency=%s)",
+                                batch_idx,
+                                total_batches,
+                                pages[0],
+                                pages[-1],
+                                timeout_s,
+                                concurrency,
+                            )
+                            return await _zerox_convert_pdf(
+                                tmp_path,
+                                timeout_s=timeout_s,
+                                concurrency=concurrency,
+                                select_pages=pages,
+                            )
+
+                    return await asyncio.gather(*(
+                        _convert_batch(batch_idx, pages)
+                        for batch_idx, pages in enumerate(batches, start=1)
+                    ))
+
+                parts = [
+                    part.strip()
+                    for part in _run_async_sync(_convert_batches())
+                    if part and part.strip()
+                ]
 
                 if not parts:
                     raise ValueError("ZeroX returned empty markdown across all page batches")
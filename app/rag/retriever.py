@@ -78,31 +78,40 @@ def search_knowledge(
 
     embedding_str = "[" + ",".join(str(v) for v in query_embedding) + "]"
 
-    sql = text("""
-        SELECT
-            c.id,
-            c.content,
-            c.enriched_content,
-            c.heading,
-            c.page_number,
-            c.document_id,
-            d.original_filename AS document_name,
-            1 - (c.embedding <=> :embedding ::vector) AS similarity
-        FROM rag_chunks c
-        JOIN rag_documents d ON d.id = c.document_id
-        WHERE d.status = 'ready'
-          AND (:doc_id IS NULL OR c.document_id = :doc_id)
-          AND 1 - (c.embedding <=> :embedding ::vector) >= :min_sim
-        ORDER BY c.embedding <=> :embedding ::vector
-        LIMIT :top_k
+    # The distance is computed once per row and ordered on directly so the
+    # HNSW index on rag_chunks.embedding can serve the top-k; the similarity
+    # threshold is applied to that small set afterwards.
+    doc_filter = "AND c.document_id = :doc_id" if document_id is not None else ""
+    sql = text(f"""
+        SELECT * FROM (
+            SELECT
+                c.id,
+                c.content,
+                c.enriched_content,
+                c.heading,
+                c.page_number,
+                c.document_id,
+                d.original_filename AS document_name,
+                c.embedding <=> :embedding ::vector AS distance
+            FROM rag_chunks c
+            JOIN rag_documents d ON d.id = c.document_id
+            WHERE d.status = 'ready'
+              {doc_filter}
+            ORDER BY distance
+            LIMIT :top_k
+        ) nearest
+        WHERE 1 - nearest.distance >= :min_sim
+        ORDER BY nearest.distance
     """)
 
-    rows = db.session.execute(sql, {
+    params = {
         "embedding": embedding_str,
-        "doc_id": document_id,
         "min_sim": min_similarity,
         "top_k": top_k,
-    }).fetchall()
+    }
+    if document_id is not None:
+        params["doc_id"] = document_id
+    rows = db.session.execute(sql, params).fetchall()
 
     results = []
     for row in rows:
@@ -114,7 +123,7 @@ def search_knowledge(
             "page_number": row.page_number,
             "document_id": row.document_id,
             "document_name": row.document_name,
-            "similarity": round(float(row.similarity), 4),
+            "similarity": round(1 - float(row.distance), 4),
         })
 
     logger.info(
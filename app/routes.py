@@ -5,13 +5,12 @@ from flask import Blueprint, render_template, request, jsonify, current_app, red
 _HK_TZ = timezone(timedelta(hours=8))
 def hk_now() -> datetime:
     return datetime.now(_HK_TZ).replace(tzinfo=None)
-from flask_jwt_extended import decode_token, jwt_required, unset_jwt_cookies
+from flask_jwt_extended import decode_token, get_jwt_identity, jwt_required, unset_jwt_cookies
 import os
 import json
 from . import agent
 from werkzeug.utils import secure_filename
 from . import gcp_bucket
-import io
 
 # Evaluation logic moved to dedicated module to keep routes lightweight
 from .pose_detection.pose_assessment import evaluate_pose_assessment
@@ -19,6 +18,7 @@ from .pose_detection.pose_assessment import evaluate_pose_assessment
 bp = Blueprint('main', __name__)
 
 SUPPORTED_LOCALES = {'zh-TW', 'en', 'ja'}
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
 
 @bp.route("/")
 @bp.route("/index")
@@ -163,7 +163,6 @@ def serve_pose_detection_js(filename):
 @jwt_required()
 def chat_stream():
     """Handle streaming chat messages and multimodal uploads."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, FileUpload, Message, UserProfile, UserApiKey, VertexServiceAccount
     
     user_id = get_jwt_identity()
@@ -380,9 +379,7 @@ def chat_stream():
                         # The client will JSON.parse() to restore the original text.
                         yield f"data: {json.dumps(chunk)}\n\n"
             except Exception as e:
-                current_app.logger.error(f"Error in streaming endpoint: {e}")
-                import traceback
-                traceback.print_exc()
+                current_app.logger.exception("Error in streaming endpoint")
                 yield f"data: {json.dumps('Error: ' + str(e))}\n\n"
 
         return Response(generate(), mimetype='text/event-stream')
@@ -398,7 +395,6 @@ def chat_stream():
 @jwt_required()
 def get_api_keys():
     """Get all API keys for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile
     
     user_id = get_jwt_identity()
@@ -422,7 +418,6 @@ def get_api_keys():
 @jwt_required()
 def create_api_key():
     """Create a new API key for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile, db
     
     user_id = get_jwt_identity()
@@ -476,7 +471,6 @@ def create_api_key():
 @jwt_required()
 def delete_api_key(key_id):
     """Delete an API key."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile, db
     
     user_id = get_jwt_identity()
@@ -508,7 +502,6 @@ def delete_api_key(key_id):
 @jwt_required()
 def toggle_api_key(key_id):
     """Toggle the selection of an API key."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile, db
     
     user_id = get_jwt_identity()
@@ -546,7 +539,6 @@ def toggle_api_key(key_id):
 @jwt_required()
 def get_user_model():
     """Get the current user's selected AI model and provider."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile, VertexServiceAccount
     
     user_id = get_jwt_identity()
@@ -612,7 +604,6 @@ def get_user_model():
 @jwt_required()
 def set_user_model():
     """Set the current user's selected AI model and provider."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserProfile, db
     
     user_id = get_jwt_identity()
@@ -673,7 +664,6 @@ def set_user_model():
 @jwt_required()
 def get_user_profile():
     """Get the current user's profile settings."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserProfile
     
     user_id = get_jwt_identity()
@@ -699,7 +689,6 @@ def get_user_profile():
 @jwt_required()
 def update_user_profile():
     """Update the current user's profile settings."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserProfile, db
     
     user_id = get_jwt_identity()
@@ -748,7 +737,6 @@ def update_user_profile():
 @jwt_required()
 def get_children():
     """Get all children profiles for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Child
     
     user_id = get_jwt_identity()
@@ -767,9 +755,7 @@ def get_children():
 @jwt_required()
 def create_child():
     """Create a new child profile for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Child, db
-    from datetime import datetime
     
     user_id = get_jwt_identity()
     data = request.get_json()
@@ -840,7 +826,6 @@ def create_child():
 @jwt_required()
 def get_child(child_id):
     """Get a specific child profile."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Child
     
     user_id = get_jwt_identity()
@@ -859,9 +844,7 @@ def get_child(child_id):
 @jwt_required()
 def update_child(child_id):
     """Update a child profile."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Child, db
-    from datetime import datetime
     
     user_id = get_jwt_identity()
     data = request.get_json()
@@ -932,7 +915,6 @@ def update_child(child_id):
 @jwt_required()
 def delete_child(child_id):
     """Delete a child profile."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Child, db
     from .video_cleanup import delete_reports_for_child
     
@@ -961,7 +943,6 @@ def delete_child(child_id):
 @jwt_required()
 def list_conversations():
     """List conversations for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation
 
     user_id = get_jwt_identity()
@@ -983,7 +964,6 @@ def list_conversations():
 @jwt_required()
 def create_conversation():
     """Create a new conversation and return its identifier."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, db
 
     user_id = get_jwt_identity()
@@ -1008,7 +988,6 @@ def create_conversation():
 @jwt_required()
 def update_conversation(conversation_id):
     """Update conversation metadata (title, pin)."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, db
 
     user_id = get_jwt_identity()
@@ -1054,7 +1033,6 @@ def update_conversation(conversation_id):
 @jwt_required()
 def delete_conversation(conversation_id):
     """Delete a conversation and its messages."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, FileUpload, db
 
     user_id = get_jwt_identity()
@@ -1082,7 +1060,6 @@ def delete_conversation(conversation_id):
 @jwt_required()
 def create_message():
     """Create a new message inside an existing conversation."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, Message, db
 
     user_id = get_jwt_identity()
@@ -1143,21 +1120,25 @@ def create_message():
                     file_upload.message_id = message.id
             db.session.commit()
 
+        # Serialize the message once and share it between the HTTP response
+        # and the room broadcast
+        message_data = message.to_dict()
+
         # Prepare response with temp_id if provided
         response_data = {
-            'message': message.to_dict(),
+            'message': message_data,
             'conversation': conversation.to_dict()
         }
         if temp_id:
             response_data['temp_id'] = temp_id
         
         # Emit socket event with temp_id for real-time updates
-        from app import socketio
-        socketio.emit('new_message', {
-            'message': message.to_dict(),
+        from .socket_events import broadcast_to_room
+        broadcast_to_room('new_message', {
+            'message': message_data,
             'conversation_id': conversation.id,
             'temp_id': temp_id
-        }, room=f"conversation_{conversation.id}")
+        }, f"conversation_{conversation.id}")
 
         return jsonify(response_data), 201
     except Exception as e:
@@ -1170,7 +1151,6 @@ def create_message():
 @jwt_required()
 def get_conversation_messages(conversation_id):
     """Retrieve ordered messages for a conversation."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, Message
 
     user_id = get_jwt_identity()
@@ -1204,17 +1184,14 @@ def serve_file():
             if bucket_name:
                 gcs_url = f'https://storage.googleapis.com/{bucket_name}/{gcs_url.lstrip("/")}'
 
-        # Download file from GCS
-        file_data = gcp_bucket.download_file_from_gcs(gcs_url)
+        # Download file from GCS (large objects spill to a temp file and are
+        # sent with the server's file wrapper rather than copied in Python)
+        file_obj = gcp_bucket.open_file_from_gcs(gcs_url)
         
         # Determine content type
         if not content_type:
             content_type = gcp_bucket.get_content_type_from_url(gcs_url)
         
-        # Create a file-like object
-        file_obj = io.BytesIO(file_data)
-        file_obj.seek(0)
-        
         # Set filename using Content-Disposition header (inline to display in browser)
         if filename:
             response = make_response(send_file(file_obj, mimetype=content_type))
@@ -1247,17 +1224,13 @@ def view_rag_document(doc_id, filename):
                 gcs_path = f'https://storage.googleapis.com/{bucket_name}/{gcs_path.lstrip("/")}'
 
         # Download file from GCS
-        file_data = gcp_bucket.download_file_from_gcs(gcs_path)
+        file_obj = gcp_bucket.open_file_from_gcs(gcs_path)
         
         # Determine content type - use extension if stored type is generic
         content_type = doc.content_type
         if not content_type or content_type == 'application/octet-stream':
             content_type = gcp_bucket.get_content_type_from_url(doc.original_filename or gcs_path)
         
-        # Create a file-like object
-        file_obj = io.BytesIO(file_data)
-        file_obj.seek(0)
-        
         return send_file(file_obj, mimetype=content_type, as_attachment=False)
     except Exception as e:
         current_app.logger.error(f"Error serving RAG document from GCS: {e}")
@@ -1270,7 +1243,6 @@ def view_rag_document(doc_id, filename):
 @jwt_required()
 def get_user_files():
     """Get all files uploaded by the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import FileUpload
 
     user_id = get_jwt_identity()
@@ -1303,9 +1275,8 @@ def upload_file_websocket():
     Upload file(s) to GCS and broadcast via WebSocket.
     This endpoint is used for file uploads in WebSocket-based chat.
     """
-    from flask_jwt_extended import get_jwt_identity
     from .models import Conversation, Message, db
-    from app import socketio
+    from .socket_events import broadcast_to_room
     
     user_id = get_jwt_identity()
     
@@ -1363,14 +1334,14 @@ def upload_file_websocket():
         
         # Broadcast file upload to WebSocket room
         room = f"conversation_{conversation_id}"
-        socketio.emit('file_uploaded', {
+        broadcast_to_room('file_uploaded', {
             'message_id': user_message.id,
             'role': 'user',
             'content': user_message.content,
             'files': uploaded_urls,
             'timestamp': user_message.created_at.isoformat() if user_message.created_at else None,
             'conversation_id': conversation_id
-        }, room=room)
+        }, room)
         
         return jsonify({
             'success': True,
@@ -1392,7 +1363,6 @@ def upload_file_websocket():
 @jwt_required()
 def create_pose_assessment_run():
     """Receive pose assessment test data from frontend, score it, and store it."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import PoseAssessmentRun, db
 
     user_id = int(get_jwt_identity())
@@ -1419,7 +1389,6 @@ def create_pose_assessment_run():
 @jwt_required()
 def get_latest_pose_assessment_run():
     """Fetch latest pose assessment run for current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import PoseAssessmentRun
 
     user_id = int(get_jwt_identity())
@@ -1439,7 +1408,6 @@ def get_latest_pose_assessment_run():
 @jwt_required()
 def delete_latest_pose_assessment_run():
     """Delete the latest pose assessment run for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import PoseAssessmentRun, db
 
     user_id = int(get_jwt_identity())
@@ -1466,7 +1434,6 @@ def delete_latest_pose_assessment_run():
 @jwt_required()
 def list_pose_assessment_runs():
     """List recent pose assessment runs for current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import PoseAssessmentRun
 
     user_id = int(get_jwt_identity())
@@ -1491,7 +1458,6 @@ def list_pose_assessment_runs():
 @jwt_required()
 def get_pose_assessment_run(run_id):
     """Fetch a specific pose assessment run for current user by run_id."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import PoseAssessmentRun
 
     user_id = int(get_jwt_identity())
@@ -1508,7 +1474,6 @@ def get_pose_assessment_run(run_id):
 @jwt_required()
 def generate_quiz():
     """根据 PDF 生成测验题目"""
-    from flask_jwt_extended import get_jwt_identity
     from app.adk import PDFQuestionnaire
 
     user_id = get_jwt_identity()
@@ -1560,9 +1525,6 @@ def generate_quiz():
 @jwt_required()
 def submit_quiz():
     """提交测验答案"""
-    from flask_jwt_extended import get_jwt_identity
-    from datetime import datetime
-
     user_id = get_jwt_identity()
 
     try:
@@ -1607,7 +1569,6 @@ def submit_quiz():
 @jwt_required()
 def generate_child_assessment():
     """Generate child development assessment questions from PDF (WS/T 580—2017)."""
-    from flask_jwt_extended import get_jwt_identity
     from app.child_assessment import ChildDevelopmentAssessmentWST580
     from app.models import ChildDevelopmentAssessmentRecord, db
     import uuid
@@ -1669,10 +1630,8 @@ def generate_child_assessment():
 @jwt_required()
 def submit_child_assessment(assessment_id):
     """Submit child development assessment answers and calculate results."""
-    from flask_jwt_extended import get_jwt_identity
     from app.child_assessment import ChildDevelopmentAssessmentWST580
     from app.models import ChildDevelopmentAssessmentRecord, db
-    from datetime import datetime
 
     user_id = get_jwt_identity()
 
@@ -1735,7 +1694,6 @@ def submit_child_assessment(assessment_id):
 @jwt_required()
 def get_assessment_history():
     """Get all previous assessment records for the user."""
-    from flask_jwt_extended import get_jwt_identity
     from app.models import ChildDevelopmentAssessmentRecord
 
     user_id = get_jwt_identity()
@@ -1762,7 +1720,6 @@ def get_assessment_history():
 @jwt_required()
 def get_assessment_detail(assessment_id):
     """Get detailed assessment results including recommendations and export options."""
-    from flask_jwt_extended import get_jwt_identity
     from app.models import ChildDevelopmentAssessmentRecord
 
     user_id = get_jwt_identity()
@@ -1793,7 +1750,6 @@ def get_assessment_detail(assessment_id):
 @jwt_required()
 def export_assessment_report(assessment_id):
     """Export assessment results as JSON."""
-    from flask_jwt_extended import get_jwt_identity
     from app.models import ChildDevelopmentAssessmentRecord
     import json as _json
 
@@ -1872,7 +1828,8 @@ def upload_pdf_for_assessment():
         unique_filename = f"{name_without_ext}_{timestamp}.pdf"
 
         file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        # 1 MiB copy buffer: ~64x fewer read/write syscalls than werkzeug's 16 KiB default
+        file.save(file_path, buffer_size=UPLOAD_COPY_BUFFER_SIZE)
 
         current_app.logger.info(f"PDF uploaded successfully: {unique_filename}")
 
@@ -1894,7 +1851,6 @@ def upload_pdf_for_assessment():
 @jwt_required()
 def create_vertex_account():
     """Create a new Vertex AI service account configuration."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import VertexServiceAccount, db
     import json
     
@@ -1949,7 +1905,6 @@ def create_vertex_account():
 @jwt_required()
 def get_vertex_accounts():
     """Get all Vertex AI service account configurations for the current user."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import VertexServiceAccount
     
     user_id = get_jwt_identity()
@@ -1969,7 +1924,6 @@ def get_vertex_accounts():
 @jwt_required()
 def update_vertex_account(account_id):
     """Update a Vertex AI service account configuration."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import VertexServiceAccount, db
     
     user_id = get_jwt_identity()
@@ -2017,7 +1971,6 @@ def update_vertex_account(account_id):
 @jwt_required()
 def delete_vertex_account(account_id):
     """Delete a Vertex AI service account configuration."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import VertexServiceAccount, UserProfile, db
     
     user_id = get_jwt_identity()
@@ -2051,7 +2004,6 @@ def delete_vertex_account(account_id):
 @jwt_required()
 def activate_vertex_account(account_id):
     """Activate a Vertex AI service account (set as selected)."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import VertexServiceAccount, UserProfile, db
     
     user_id = get_jwt_identity()
@@ -2093,7 +2045,6 @@ def activate_vertex_account(account_id):
 @jwt_required()
 def activate_vertex_api_key(key_id):
     """Activate a Vertex AI API key (set as selected Vertex credential)."""
-    from flask_jwt_extended import get_jwt_identity
     from .models import UserApiKey, UserProfile, db
 
     user_id = get_jwt_identity()
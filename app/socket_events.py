@@ -7,11 +7,17 @@ from flask_socketio import emit, join_room, leave_room
 from socketio.exceptions import ConnectionRefusedError
 from flask_jwt_extended import decode_token, verify_jwt_in_request
 from app import socketio, get_app
+from .fast_json import SocketIOJSON
 from .models import db, User, Conversation, Message, UserProfile, UserApiKey, VertexServiceAccount, hk_now
 from datetime import datetime
+from collections import OrderedDict
+from sqlalchemy import event, select
 import logging
 import os
+import socket
 import threading
+import time
+import uuid
 from .agent import chat_agent
 
 logger = logging.getLogger(__name__)
@@ -35,6 +41,151 @@ def _remove_sid_activity(sid: str | None = None) -> None:
         _sid_last_activity.pop(target_sid, None)
 
 
+def _enable_tcp_nodelay() -> None:
+    """Disable Nagle's algorithm on the WebSocket's TCP socket.
+
+    Streamed AI chunks are small writes; without TCP_NODELAY they can sit
+    behind a delayed ACK for ~40 ms each.
+    """
+    environ = request.environ
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None or not hasattr(sock, 'setsockopt'):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError as exc:
+        logger.debug('Could not set TCP_NODELAY for sid=%s: %s', request.sid, exc)
+
+
+# Display names for typing/message events. Entries expire so renames and
+# deletes made by other workers (or bulk SQL) are picked up; connect auth
+# never trusts this cache.
+USERNAME_CACHE_TTL_SECONDS = 60
+USERNAME_CACHE_MAX_ENTRIES = 8192
+_username_cache: OrderedDict[int, tuple[float, str]] = OrderedDict()
+_username_cache_lock = threading.Lock()
+
+
+def _lookup_username(user_id: int) -> str | None:
+    """Return the username for ``user_id`` or None if the user does not exist.
+
+    A single-column select keeps the statement in SQLAlchemy's compiled
+    cache and avoids hydrating a full User row.
+    """
+    return db.session.execute(
+        select(User.username).where(User.id == user_id)
+    ).scalar_one_or_none()
+
+
+def _get_username(user_id, fresh: bool = False) -> str | None:
+    """Username lookup tolerant of string IDs from JWT subjects.
+
+    Results are cached for ``USERNAME_CACHE_TTL_SECONDS``; ``fresh=True``
+    always asks the database (used to authenticate connections).
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    if not fresh:
+        with _username_cache_lock:
+            entry = _username_cache.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                _username_cache.move_to_end(user_id)
+                return entry[1]
+
+    username = _lookup_username(user_id)
+    with _username_cache_lock:
+        if username is None:
+            _username_cache.pop(user_id, None)
+        else:
+            _username_cache[user_id] = (time.monotonic() + USERNAME_CACHE_TTL_SECONDS, username)
+            _username_cache.move_to_end(user_id)
+            while len(_username_cache) > USERNAME_CACHE_MAX_ENTRIES:
+                _username_cache.popitem(last=False)
+    return username
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_username_cache(mapper, connection, target) -> None:
+    """Drop cached lookups whenever a user row changes in this process."""
+    with _username_cache_lock:
+        _username_cache.clear()
+
+
+# Payloads above this size are split into stream_header/stream_chunk events
+# so one message never becomes a single multi-MiB WebSocket frame.
+STREAM_THRESHOLD_BYTES = 512 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+MAX_CHUNKS_PER_BATCH = 8
+
+
+def _emit_streamed(event: str, encoded: str, to: str, namespace: str = '/') -> None:
+    """Send an already-encoded payload as a header plus fixed-size chunks.
+
+    The client (SocketManager) reassembles chunks by ``stream_id`` and then
+    dispatches ``event`` with the decoded payload as if it arrived whole.
+    """
+    stream_id = uuid.uuid4().hex
+    chunk_count = (len(encoded) + STREAM_CHUNK_BYTES - 1) // STREAM_CHUNK_BYTES
+    socketio.emit('stream_header', {
+        'stream_id': stream_id,
+        'event': event,
+        'total_bytes': len(encoded),
+        'chunk_count': chunk_count,
+    }, to=to, namespace=namespace)
+
+    for index in range(chunk_count):
+        start = index * STREAM_CHUNK_BYTES
+        socketio.emit('stream_chunk', {
+            'stream_id': stream_id,
+            'index': index,
+            'data': encoded[start:start + STREAM_CHUNK_BYTES],
+        }, to=to, namespace=namespace)
+        if (index + 1) % MAX_CHUNKS_PER_BATCH == 0:
+            # Let pings/pongs and other clients' frames through.
+            socketio.sleep(0)
+
+
+def _encoded_size_bound(value) -> int:
+    """Upper bound on the JSON-encoded length of ``value`` without encoding it.
+
+    A character encodes to at most twelve characters (an escaped surrogate
+    pair with the stdlib encoder), so most payloads are proven small by this
+    walk and encoded only once, by ``socketio.emit`` itself.
+    """
+    if isinstance(value, str):
+        return 12 * len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(_encoded_size_bound(k) + _encoded_size_bound(v) + 2 for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(_encoded_size_bound(item) + 1 for item in value)
+    # Numbers, booleans, None and datetimes all encode well under this
+    return 40
+
+
+def broadcast_to_room(event: str, payload: dict, room: str, namespace: str = '/') -> None:
+    """
+    Emit an event to every client in a room.
+
+    A room emit is encoded once by python-socketio and the same packet is
+    sent to each participant. Payloads larger than ``STREAM_THRESHOLD_BYTES``
+    are sent in chunks so one message never becomes a multi-MiB frame.
+    """
+    encoded = None
+    if _encoded_size_bound(payload) > STREAM_THRESHOLD_BYTES:
+        # Possibly large: measure exactly, and reuse the encoding if chunked
+        encoded = SocketIOJSON.dumps(payload)
+
+    if encoded is not None and len(encoded) > STREAM_THRESHOLD_BYTES:
+        _emit_streamed(event, encoded, room, namespace)
+    else:
+        socketio.emit(event, payload, to=room, namespace=namespace)
+
+
 def _idle_disconnect_loop() -> None:
     """Disconnect sockets that have been idle beyond configured timeout."""
     while True:
@@ -95,21 +246,22 @@ def handle_connect(auth):
             decoded_token = decode_token(token)
             user_id = decoded_token['sub']
             
-            # Verify user exists
-            user = User.query.get(user_id)
-            if not user:
+            # Verify user exists (never from cache, so deleted users are refused)
+            username = _get_username(user_id, fresh=True)
+            if username is None:
                 raise ConnectionRefusedError('Invalid user')
             
             # Store user info in session
             request.sid_to_user_id = {request.sid: user_id}
             _touch_sid_activity(request.sid)
+            _enable_tcp_nodelay()
 
             global _idle_checker_started
             if not _idle_checker_started:
                 _idle_checker_started = True
                 socketio.start_background_task(_idle_disconnect_loop)
             
-            print(f"User {user.username} (ID: {user_id}) connected with SID: {request.sid}")
+            print(f"User {username} (ID: {user_id}) connected with SID: {request.sid}")
             
             emit('connected', {
                 'status': 'success',
@@ -347,8 +499,7 @@ def handle_send_message(data):
         
         try:
             # Get user's name for personalization
-            user = User.query.get(user_id)
-            username = user.username if user else None
+            username = _get_username(user_id)
             
             # Stream AI response using ADK agent
             for chunk in chat_agent.generate_streaming_response(
@@ -373,7 +524,8 @@ def handle_send_message(data):
                 
                 ai_response_text += chunk
                 
-                # Stream chunk to client
+                # Stream chunk to client; chat_agent already merges small
+                # model fragments (STREAM_COALESCE_*) with a timed flush
                 emit('ai_response_chunk', {
                     'chunk': chunk,
                     'conversation_id': conversation_id
@@ -443,8 +595,8 @@ def handle_typing(data):
             return
         
         # Get user info
-        user = User.query.get(user_id)
-        if not user:
+        username = _get_username(user_id)
+        if username is None:
             return
         
         room = f"conversation_{conversation_id}"
@@ -452,7 +604,7 @@ def handle_typing(data):
         # Broadcast typing status to room (exclude sender)
         emit('user_typing', {
             'user_id': user_id,
-            'username': user.username,
+            'username': username,
             'is_typing': is_typing,
             'conversation_id': conversation_id
         }, room=room, include_self=False)
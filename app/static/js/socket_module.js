@@ -21,6 +21,7 @@ class SocketManager {
         this.lastActivityEmitAt = 0;
         this.userInteractionListener = this.handleUserInteraction.bind(this);
         this.refreshRequired = false;
+        this.incomingStreams = {};
     }
 
     /**
@@ -205,6 +206,31 @@ class SocketManager {
         this.socket.on('user_typing', (data) => {
             this.trigger('user_typing', data);
         });
+
+        // Large payloads arrive as a header followed by ordered chunks
+        this.socket.on('stream_header', (data) => {
+            this.incomingStreams[data.stream_id] = {
+                event: data.event,
+                chunks: new Array(data.chunk_count),
+                received: 0
+            };
+        });
+
+        this.socket.on('stream_chunk', (data) => {
+            const stream = this.incomingStreams[data.stream_id];
+            if (!stream) return;
+
+            stream.chunks[data.index] = data.data;
+            stream.received += 1;
+            if (stream.received < stream.chunks.length) return;
+
+            delete this.incomingStreams[data.stream_id];
+            try {
+                this.trigger(stream.event, JSON.parse(stream.chunks.join('')));
+            } catch (error) {
+                console.error(`Error reassembling ${stream.event} stream:`, error);
+            }
+        });
     }
 
     /**
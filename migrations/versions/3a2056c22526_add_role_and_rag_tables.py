@@ -18,6 +18,10 @@ depends_on = None
 
 
 def upgrade():
+    # Required by the VECTOR column below; a no-op where it already exists
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+
     # ### commands auto generated by Alembic - please adjust! ###
     with op.batch_alter_table('rag_chunks', schema=None) as batch_op:
         batch_op.add_column(sa.Column('document_id', sa.Integer(), nullable=False))
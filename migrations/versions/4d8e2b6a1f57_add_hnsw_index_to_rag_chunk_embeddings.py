@@ -0,0 +1,35 @@
+"""add hnsw index to rag_chunks.embedding
+
+Revision ID: 4d8e2b6a1f57
+Revises: 9f1c2a8d4e73
+Create Date: 2026-10-17 11:02:47.518306
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8e2b6a1f57'
+down_revision = '9f1c2a8d4e73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.create_index(
+        'ix_rag_chunks_embedding_hnsw',
+        'rag_chunks',
+        ['embedding'],
+        unique=False,
+        postgresql_using='hnsw',
+        postgresql_with={'m': 16, 'ef_construction': 64},
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_rag_chunks_embedding_hnsw', table_name='rag_chunks')
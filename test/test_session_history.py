@@ -0,0 +1,61 @@
+"""
+Tests for detecting whether an ADK session already holds a client's history.
+
+Both client shapes are covered: the web client sends ``{role, content}``
+items with the current message already appended, and the Socket.IO path
+sends ``{sender, content}`` items loaded from the database.
+"""
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("google.adk")
+
+from app.agent.chat_agent import ChatAgentManager, _last_user_message
+
+
+def _web_history(*turns):
+    """Build web-client history: (user, bot) pairs, then the pending user message."""
+    history = []
+    for user_text, bot_text in turns[:-1]:
+        history.append({'role': 'user', 'content': user_text})
+        history.append({'role': 'bot', 'content': bot_text})
+    history.append({'role': 'user', 'content': turns[-1]})
+    return history
+
+
+def _socket_history(*turns):
+    """Build Socket.IO history: same turns with ``sender`` instead of ``role``."""
+    return [
+        {'sender': 'assistant' if item['role'] == 'bot' else 'user', 'content': item['content']}
+        for item in _web_history(*turns)
+    ]
+
+
+@pytest.mark.parametrize("build", [_web_history, _socket_history])
+def test_last_user_message_skips_current_turn(build):
+    history = build(("Hello", "Hi there"), "How do toddlers learn words?")
+
+    assert _last_user_message(history, "How do toddlers learn words?") == "Hello"
+
+
+@pytest.mark.parametrize("build", [_web_history, _socket_history])
+def test_session_has_history_after_answered_turn(build):
+    manager = ChatAgentManager()
+    manager.record_session_turn("u1", "conv_u1_1", "Hello")
+    history = build(("Hello", "Hi there"), "Next question")
+
+    assert manager.session_has_history("u1", "conv_u1_1", history, "Next question")
+    assert not manager.session_has_history("u1", "conv_u1_2", history, "Next question")
+
+
+@pytest.mark.parametrize("build", [_web_history, _socket_history])
+def test_repeated_message_compares_previous_turn(build):
+    manager = ChatAgentManager()
+    history = build(("Same text", "Answer"), "Same text")
+
+    manager.record_session_turn("u1", "conv_u1_1", "Something else")
+    assert not manager.session_has_history("u1", "conv_u1_1", history, "Same text")
+
+    manager.record_session_turn("u1", "conv_u1_1", "Same text")
+    assert manager.session_has_history("u1", "conv_u1_1", history, "Same text")